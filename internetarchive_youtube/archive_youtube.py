@@ -3,24 +3,44 @@
 
 import concurrent.futures
 import contextlib
-import itertools
+import functools
 import os
 import random
 import re
+import queue
 import signal
 import string
+import subprocess
 import sys
 import threading
 import time
 import uuid
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
 
 import pymongo
 import requests
 import yt_dlp
 from internetarchive import get_item, upload
+from internetarchive_youtube import feeds, profiling
+from internetarchive_youtube.autoscale import DOWNLOAD, UPLOAD, Autoscaler
+from internetarchive_youtube.bandwidth import BandwidthManager, ThrottledFile
+from internetarchive_youtube.bundles import (DEFAULT_PERIOD, BundleEntry,
+                                             Bundler, file_metadata,
+                                             item_metadata, period_label)
+from internetarchive_youtube.checksums import IncrementalHasher
+from internetarchive_youtube.circuit_breaker import (RATE_LIMIT,
+                                                     TRANSIENT,
+                                                     CircuitBreakers,
+                                                     classify_error)
+from internetarchive_youtube.cold_store import (archive_mongo, is_finished,
+                                                sweep_mongo)
+from internetarchive_youtube.create_collection import CreateCollection
 from internetarchive_youtube.jsonbin_manager import JSONBin
+from internetarchive_youtube.streaming import (PART_SIZE, MultipartUpload,
+                                               NotStreamable, PipeUpload,
+                                               can_stream, check_streamable)
+from internetarchive_youtube.ydl_pool import YoutubeDLPool
 from loguru import logger
 from pymongo.collection import Collection
 from tqdm import tqdm
@@ -39,6 +59,105 @@ class NoStorageSecretFound(Exception):
     """Raised when no storage database secret is found."""
 
 
+PENDING_QUERY = {
+    '$or': [{
+        'downloaded': {
+            '$in': [False, None]
+        }
+    }, {
+        'uploaded': {
+            '$in': [False, None]
+        }
+    }],
+    'downloaded': {
+        '$ne': 'not available'
+    },
+    'uploaded': {
+        '$ne': 'not available'
+    }
+}
+# Bookkeeping fields that are kept in the backend, but never sent to
+# archive.org as item metadata.
+STATE_FIELDS = [
+    '_id', 'downloaded', 'uploaded', 'md5', 'sha1', 'failures', 'last_error',
+    'next_attempt_at', 'ext', 'filesize_approx', 'is_live', 'availability',
+    'item'
+]
+REF_PROJECTION = {
+    '_id': 1,
+    'channel_name': 1,
+    'downloaded': 1,
+    'uploaded': 1,
+    'filesize_approx': 1,
+    'duration': 1,
+    'upload_date': 1,
+    'next_attempt_at': 1
+}
+# Availability values (recorded at scan time) of videos that cannot be
+# downloaded.
+UNAVAILABLE = ['private']
+# Backoff of failing videos: 1 hour after the first failure, doubling after
+# every consecutive failure, up to a week.
+RETRY_BASE_DELAY = 3600
+RETRY_MAX_DELAY = 7 * 24 * 3600
+
+
+class VideoRef:
+    """A compact, in-memory reference to a pending video.
+
+    Only the fields needed to filter and schedule the work are kept. The full
+    document is fetched from the backend right before the video is processed.
+    """
+    __slots__ = ('_id', 'channel_name', 'downloaded', 'uploaded', 'size',
+                 'duration', 'upload_date', 'next_attempt_at')
+
+    def __init__(self,
+                 _id: str,
+                 channel_name: str,
+                 downloaded=False,
+                 uploaded=False,
+                 size: Optional[int] = None,
+                 duration: Optional[float] = None,
+                 next_attempt_at: Optional[float] = None,
+                 upload_date: Optional[str] = None):
+        self._id = _id
+        self.channel_name = channel_name
+        self.downloaded = downloaded
+        self.uploaded = uploaded
+        self.size = size
+        self.duration = duration
+        self.upload_date = upload_date
+        self.next_attempt_at = next_attempt_at
+
+    @classmethod
+    def from_record(cls, record: dict) -> 'VideoRef':
+        """Create a reference from a (full or projected) backend record."""
+        return cls(record['_id'], record['channel_name'],
+                   record.get('downloaded', False),
+                   record.get('uploaded', False),
+                   record.get('filesize_approx'), record.get('duration'),
+                   record.get('next_attempt_at'), record.get('upload_date'))
+
+    def __repr__(self) -> str:
+        return f'VideoRef({self._id!r}, {self.channel_name!r})'
+
+
+def _bounded_map(executor: concurrent.futures.Executor, fn, iterable,
+                 max_in_flight: int):
+    """Like `executor.map`, but never submits more than `max_in_flight`
+    tasks at once, and yields the results in completion order."""
+    pending = set()
+    for item in iterable:
+        if len(pending) >= max_in_flight:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(fn, item))
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
+
+
 class ArchiveYouTube:
 
     def __init__(self,
@@ -52,7 +171,23 @@ class ArchiveYouTube:
                  ignore_video_ids: Optional[list] = None,
                  use_aria2c: bool = False,
                  specific_channel: str = None,
-                 cookies_file: str = None):
+                 cookies_file: str = None,
+                 sha1: bool = False,
+                 breaker_cooldown: float = 900,
+                 autoscale: bool = False,
+                 download_limits: tuple = (1, 16),
+                 upload_limits: tuple = (1, 16),
+                 max_download_rate: Optional[int] = None,
+                 max_upload_rate: Optional[int] = None,
+                 max_total_rate: Optional[int] = None,
+                 dash: bool = False,
+                 max_height: Optional[int] = None,
+                 max_filesize: Optional[int] = None,
+                 fragment_concurrency: int = 1,
+                 stream: bool = False,
+                 stream_part_size: int = PART_SIZE,
+                 bundle_size: Optional[int] = None,
+                 bundle_period: str = DEFAULT_PERIOD):
         """Initialize the class.
 
         Args:
@@ -63,6 +198,40 @@ class ArchiveYouTube:
             no_logs: Disable logging.
             multithreading: Use multithreading to process channel videos.
             threads: Maximum threads to use when multithreading is enabled.
+            sha1: Also compute the SHA1 digest of every download (MD5 is
+                always computed).
+            breaker_cooldown: Seconds to pause a channel (or all channels,
+                when rate-limited) after repeated failures.
+            autoscale: Adapt the download and upload concurrency to the
+                measured throughput when multithreading is enabled, instead
+                of using a fixed number of threads.
+            download_limits: (floor, ceiling) of the download concurrency
+                when autoscaling.
+            upload_limits: (floor, ceiling) of the upload concurrency when
+                autoscaling.
+            max_download_rate: Ceiling of all downloads combined, in bytes
+                per second.
+            max_upload_rate: Ceiling of all uploads combined, in bytes per
+                second.
+            max_total_rate: Ceiling of all downloads and uploads combined, in
+                bytes per second.
+            dash: Download the best adaptive video and audio streams in
+                parallel and merge them with ffmpeg, instead of the best
+                single-file format.
+            max_height: Maximum height of the downloaded video.
+            max_filesize: Maximum size of each downloaded stream, in bytes.
+            fragment_concurrency: Number of fragments of a fragmented format
+                (DASH/HLS) to download concurrently.
+            stream: Stream single-file downloads straight into archive.org
+                multipart uploads, without writing them to disk. Other
+                formats are still downloaded to disk.
+            stream_part_size: Size of each part of a streamed upload, in
+                bytes.
+            bundle_size: Upload the videos smaller than this (in bytes) as
+                the files of one item per channel and period, instead of one
+                item per video.
+            bundle_period: Period of the videos of a bundle (`month` or
+                `year`).
         """
         self.prioritize = prioritize
         self.skip_list = skip_list
@@ -75,8 +244,31 @@ class ArchiveYouTube:
         self.use_aria2c = use_aria2c
         self.specific_channel = specific_channel
         self.cookies_file = cookies_file
+        self.sha1 = sha1
+        self.breakers = CircuitBreakers(cooldown=breaker_cooldown)
+        self.autoscale = autoscale
+        self.download_limits = download_limits
+        self.upload_limits = upload_limits
+        self.autoscaler = None
+        self.bandwidth = None
+        if max_download_rate or max_upload_rate or max_total_rate:
+            self.bandwidth = BandwidthManager(max_download_rate,
+                                              max_upload_rate, max_total_rate)
+        self.dash = dash
+        self.max_height = max_height
+        self.max_filesize = max_filesize
+        self.fragment_concurrency = fragment_concurrency
+        self.stream = stream
+        self.stream_part_size = stream_part_size
+        if stream and (dash or use_aria2c or not can_stream()):
+            logger.warning('Streaming is not possible with `--dash`, with '
+                           'aria2c or without named pipes. Downloading to '
+                           'disk instead...')
+            self.stream = False
+        self.bundler = Bundler(bundle_size,
+                               bundle_period) if bundle_size else None
+        self.ydl_pool = YoutubeDLPool(self.ydl_params())
         self._data = None
-        self._lock = threading.Lock()
 
     def keyboard_interrupt_handler(self, sig: int, _) -> None:
         logger.warning(f'\nKeyboardInterrupt (id: {sig}) has been caught...')
@@ -89,6 +281,20 @@ class ArchiveYouTube:
             _ = [x.unlink() for x in sum(tmp_files, [])]
         sys.exit(1)
 
+    def _stage_slot(self, stage: str):
+        """Return a context manager that holds a concurrency slot of a
+        stage when autoscaling (a no-op otherwise)."""
+        if not self.autoscaler:
+            return contextlib.nullcontext()
+        return self.autoscaler.slot(stage)
+
+    def _download_slot(self, ydl: yt_dlp.YoutubeDL):
+        """Return a context manager that registers a download with the
+        bandwidth manager (a no-op when no ceiling is set)."""
+        if not self.bandwidth:
+            return contextlib.nullcontext()
+        return self.bandwidth.download_slot(ydl.params)
+
     @staticmethod
     def clean_fname(file_name: str) -> str:
         """Clean a file name to remove all special characters.
@@ -106,11 +312,68 @@ class ArchiveYouTube:
         clean_name = re.sub(r'_{2,}', '_', fname)
         return clean_name
 
-    def get_video_extension(self, video_url):
-        ydl_opts = {'quiet': True, 'format': 'best'}
+    def format_selector(self) -> str:
+        """Return the yt-dlp format selector of the run."""
+        filters = ''
+        if self.max_height:
+            filters += f'[height<={self.max_height}]'
+        if self.max_filesize:
+            filters += f'[filesize<?{self.max_filesize}]'
+        selector = f'bv*{filters}+ba/b{filters}' if self.dash else \
+            f'best{filters}'
+        if filters:
+            # Nothing within the ceiling: fall back to the smallest format.
+            selector += '/w'
+        return selector
+
+    def ydl_params(self) -> dict:
+        """Return the YoutubeDL options shared by every call of the run."""
+        params = {
+            'format': self.format_selector(),
+            'concurrent_fragment_downloads': self.fragment_concurrency
+        }
+
+        if self.dash:
+            params.update({'merge_output_format': 'mp4/mkv'})
+
+        if self.no_logs:
+            params.update({
+                'quiet': True,
+                'no_warnings': True,
+                'noprogress': True,
+                'verbose': False,
+                'logtostderr': True
+            })
+
         if self.cookies_file:
-            ydl_opts.update({'cookiefile': self.cookies_file})
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            params.update({'cookiefile': self.cookies_file})
+
+        if self.use_aria2c:
+            params.update({'external_downloader': 'aria2c'})
+
+        return params
+
+    def stored_extension(self, video: dict) -> Optional[str]:
+        """Return the extension of a video from its scan-time metadata.
+
+        Args:
+            video: Video record.
+
+        Returns:
+            The extension (with a leading dot), `'not available'`, or None if
+            the video has to be extracted to know it (no scan-time metadata,
+            a live stream, or a non-default format selector).
+        """
+        if video.get('availability') in UNAVAILABLE:
+            return 'not available'
+        if not video.get('ext') or video.get('is_live') or \
+                self.format_selector() != 'best':
+            return None
+        return f'.{video["ext"]}'
+
+    def get_video_extension(self, video_url):
+        with self.ydl_pool.get(quiet=True) as ydl, profiling.span(
+                'extract', url=video_url):
             try:
                 info = ydl.extract_info(video_url, download=False)
             except Exception as e:
@@ -120,47 +383,106 @@ class ArchiveYouTube:
             filename = ydl.prepare_filename(info)
             return Path(filename).suffix
 
-    def load_data(
-        self
-    ) -> Tuple[bool, bool, Optional[Collection], Optional[JSONBin],
-               Optional[str], list]:
-        """Load data from the database.
+    def connect_backend(
+            self) -> Tuple[bool, bool, Optional[Collection], Optional[JSONBin]]:
+        """Connect to the backend database.
 
         Returns:
-            tuple: (mongodb, jsonbin, col, jb, bin_id, data)
+            tuple: (mongodb, jsonbin, col, jb)
         """
-        jsonbin = False
-        mongodb = False
-
         if os.getenv('MONGODB_CONNECTION_STRING'):
             client = pymongo.MongoClient(
                 os.getenv('MONGODB_CONNECTION_STRING'))
-            db = client['yt']
-            col = db['DATA']
-            data = list(db['DATA'].find({}))
-            mongodb = True
-            jb = None
-            bin_id = None
+            return True, False, client['yt']['DATA'], None
 
         elif os.getenv('JSONBIN_KEY'):
             jb = JSONBin(os.getenv('JSONBIN_KEY'), no_logs=self.no_logs)
-            bin_id = jb.handle_collection_bins()
-            data = jb.read_bin(bin_id)['record']
-            jsonbin = True
-            col = None
+            return False, True, None, jb
+
+        raise NoStorageSecretFound('You need at least one storage secret ('
+                                   '`MONGODB_CONNECTION_STRING` or '
+                                   '`JSONBIN_KEY`!')
+
+    @profiling.profiled('load_data')
+    def load_data(
+        self,
+        backend: Optional[tuple] = None,
+        sweep: bool = False
+    ) -> Tuple[bool, bool, Optional[Collection], Optional[JSONBin],
+               Optional[str], list]:
+        """Load data from the database.
+
+        Videos whose `next_attempt_at` is still in the future (see
+        `schedule_retry`) are left out.
+
+        Args:
+            backend: (mongodb, jsonbin, col, jb) of an open connection to
+                reuse (see `connect_backend`). The records that `jb` already
+                holds are then reused instead of being read again.
+            sweep: Move the finished videos that are still in the hot state
+                (e.g. from before the cold store existed) to the cold store
+                first. Done once, when a run starts.
+
+        Returns:
+            tuple: (mongodb, jsonbin, col, jb, bin_id, data). With JSONBin,
+                `bin_id` is the ID of the shard index bin. `data` is a list of
+                `VideoRef` of the pending videos.
+        """
+        mongodb, jsonbin, col, jb = backend or self.connect_backend()
+        now = time.time()
+        bin_id = None
+        moved = 0
+
+        if mongodb:
+            if sweep:
+                moved = sweep_mongo(col)
+            query = {
+                **PENDING_QUERY, 'next_attempt_at': {
+                    '$not': {
+                        '$gt': now
+                    }
+                }
+            }
+            data = [
+                VideoRef.from_record(x)
+                for x in col.find(query, REF_PROJECTION)
+            ]
 
         else:
-            raise NoStorageSecretFound('You need at least one storage secret ('
-                                       '`MONGODB_CONNECTION_STRING` or '
-                                       '`JSONBIN_KEY`!')
+            if backend:
+                data = [VideoRef.from_record(x) for x in jb.records()]
+            else:
+                data = [VideoRef.from_record(x) for x in jb.load_shards()]
+            if sweep:
+                moved = jb.sweep()
+            bin_id = jb.index_bin_id
+
+        if moved:
+            logger.debug(f'Moved {moved} finished videos to the cold store.')
 
-        data = [x for x in data if not x['downloaded'] or not x['uploaded']]
+        data = [x for x in data if not x.downloaded or not x.uploaded]
         data = [
-            x for x in data if x['downloaded'] != 'not available'
-            and x['uploaded'] != 'not available'
+            x for x in data if x.downloaded != 'not available'
+            and x.uploaded != 'not available'
+        ]
+        data = [
+            x for x in data
+            if not x.next_attempt_at or x.next_attempt_at <= now
         ]
 
         random.shuffle(data)
+        if self.bundler:
+            # Videos of the same bundle are processed together, so that their
+            # group fills up instead of waiting on disk for the end of the
+            # run.
+            bundled = sorted(
+                (x for x in data if self.bundler.accepts(x.size)),
+                key=lambda x: (x.channel_name,
+                               period_label(x.upload_date or '',
+                                            self.bundler.period)))
+            data = bundled + [
+                x for x in data if not self.bundler.accepts(x.size)
+            ]
 
         if not self.prioritize and os.getenv('PRIORITIZE_CHANNELS'):
             self.prioritize = os.getenv('PRIORITIZE_CHANNELS').split(',')
@@ -170,17 +492,137 @@ class ArchiveYouTube:
             first = []
             second = []
             for item in data:
-                if item['channel_name'].lower() in prioritize:
+                if item.channel_name.lower() in prioritize:
                     first.append(item)
                 else:
                     second.append(item)
             data = first + second
         if self.specific_channel:
             data = [
-                x for x in data if x['channel_name'] == self.specific_channel
+                x for x in data if x.channel_name == self.specific_channel
             ]
         return mongodb, jsonbin, col, jb, bin_id, data
 
+    @staticmethod
+    def fetch_video(ref: VideoRef, mongodb: bool, jsonbin: bool,
+                    col: Optional[Collection],
+                    jb: Optional[JSONBin]) -> Optional[dict]:
+        """Fetch the full document of a pending video.
+
+        Args:
+            ref: Reference to the video.
+            mongodb: Whether to read from MongoDB.
+            jsonbin: Whether to read from JSONBin.
+            col: MongoDB collection to read from.
+            jb: JSONBin instance to read from.
+
+        Returns:
+            The video document, or None if it no longer exists.
+        """
+        if mongodb:
+            return col.find_one({'_id': ref._id})
+        elif jsonbin:
+            return jb.get_record(ref._id)
+
+    def process_ref(self, ref: VideoRef, mongodb: bool, jsonbin: bool,
+                    col: Optional[Collection], jb: Optional[JSONBin],
+                    bin_id: Optional[str]) -> None:
+        """Fetch the full document of a queued video and process it.
+
+        Args:
+            ref: Reference to the video to process.
+            mongodb: Whether to save to MongoDB.
+            jsonbin: Whether to save to JSONBin.
+            col: MongoDB collection to save to.
+            jb: JSONBin instance to save to.
+            bin_id: JSONBin index bin ID.
+        """
+        with profiling.span('fetch_video', _id=ref._id):
+            video = self.fetch_video(ref, mongodb, jsonbin, col, jb)
+        if not video:
+            logger.warning(f'Video with id {ref._id} no longer exists in the '
+                           'database. Skipping...')
+            return
+        self.process_video(video, mongodb, jsonbin, col, jb, bin_id)
+
+    @staticmethod
+    def update_video(video: dict, mongodb: bool, jsonbin: bool,
+                     col: Optional[Collection], jb: Optional[JSONBin],
+                     **fields) -> None:
+        """Set fields of a video and persist them to the backend.
+
+        With JSONBin, only the shard of the video's channel is rewritten. A
+        video that is finished by the update is moved to the cold store.
+
+        Args:
+            video: Video to update.
+            mongodb: Whether to save to MongoDB.
+            jsonbin: Whether to save to JSONBin.
+            col: MongoDB collection to save to.
+            jb: JSONBin instance to save to.
+            **fields: The fields to set.
+        """
+        with profiling.span('state_write', _id=video['_id']):
+            if mongodb:
+                video.update(fields)
+                if is_finished(video):
+                    archive_mongo(col, [video])
+                else:
+                    col.update_one({'_id': video['_id']}, {'$set': fields})
+            elif jsonbin:
+                jb.update_record(video, **fields)
+
+    def schedule_retry(self, video: dict, error_class: str, mongodb: bool,
+                       jsonbin: bool, col: Optional[Collection],
+                       jb: Optional[JSONBin]) -> None:
+        """Record a failed attempt and back off the next one exponentially.
+
+        Rate-limit failures are not the video's fault, so they are not
+        counted.
+
+        Args:
+            video: The video that failed.
+            error_class: The class returned by `classify_error`.
+            mongodb: Whether to save to MongoDB.
+            jsonbin: Whether to save to JSONBin.
+            col: MongoDB collection to save to.
+            jb: JSONBin instance to save to.
+        """
+        if error_class == RATE_LIMIT:
+            return
+        failures = (video.get('failures') or 0) + 1
+        delay = min(RETRY_BASE_DELAY * 2**(failures - 1), RETRY_MAX_DELAY)
+        logger.debug(f'{video["_id"]} failed {failures} time(s). Next attempt '
+                     f'in {delay / 3600:.0f} hour(s)...')
+        self.update_video(video,
+                          mongodb,
+                          jsonbin,
+                          col,
+                          jb,
+                          failures=failures,
+                          last_error=error_class,
+                          next_attempt_at=time.time() + delay)
+
+    def failure_report(self, limit: int = 20) -> list:
+        """Return the videos that failed the most times.
+
+        Args:
+            limit: Maximum number of videos to return.
+
+        Returns:
+            list: Video documents sorted by descending number of failures.
+        """
+        mongodb, _, col, jb = self.connect_backend()
+        if mongodb:
+            return list(
+                col.find({
+                    'failures': {
+                        '$gt': 0
+                    }
+                }).sort('failures', pymongo.DESCENDING).limit(limit))
+        data = [x for x in jb.load_shards() if x.get('failures')]
+        return sorted(data, key=lambda x: x['failures'], reverse=True)[:limit]
+
     def create_metadata(self, video: dict) -> Tuple[str, str, dict, str]:
         """Create metadata for the video.
 
@@ -204,7 +646,7 @@ class ArchiveYouTube:
         custom_fields = {
             k: v
             for k, v in video.items()
-            if k not in ['_id', 'downloaded', 'uploaded']
+            if k not in STATE_FIELDS and v is not None
         }
         md = {
             'collection':
@@ -226,33 +668,116 @@ class ArchiveYouTube:
         }
         return _id, title, md, identifier
 
-    def download(self, video: dict, ydl_opts: dict,
-                 fname: str) -> Optional[bool]:
+    @staticmethod
+    def _download_streams(
+            ydl: yt_dlp.YoutubeDL,
+            video_url: str,
+            bandwidth: Optional[BandwidthManager] = None) -> None:
+        """Download a video, fetching the streams of a merged format in
+        parallel.
+
+        yt-dlp downloads the streams of a merged format one after the other.
+        Here they are downloaded concurrently to the file names yt-dlp would
+        use, so that yt-dlp then finds them already downloaded and only
+        merges them (and cleans them up).
+
+        Args:
+            ydl: The YoutubeDL instance to use.
+            video_url: URL of the video.
+            bandwidth: Bandwidth manager the download is registered with.
+        """
+        info = ydl.extract_info(video_url, download=False)
+        formats = info.get('requested_formats') or []
+        if len(formats) > 1:
+            if bandwidth:
+                bandwidth.set_streams(ydl.params, len(formats))
+            base, ext = os.path.splitext(ydl.prepare_filename(info, 'temp'))
+            if ext[1:] != info['ext']:
+                base += ext
+            os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(formats)) as executor:
+                futures = []
+                for fmt in formats:
+                    stream_info = {**info, **fmt}
+                    del stream_info['requested_formats']
+                    stream_fname = (f'{base}.f{fmt["format_id"]}.'
+                                    f'{stream_info["ext"]}')
+                    futures.append(
+                        executor.submit(ydl.dl, stream_fname, stream_info))
+                for future in futures:
+                    future.result()
+        ydl.process_ie_result(ydl.sanitize_info(info, True), download=True)
+
+    @staticmethod
+    def _stream_download(ydl: yt_dlp.YoutubeDL, video_url: str,
+                         pipe: PipeUpload) -> None:
+        """Download a video into the named pipe of a `PipeUpload`.
+
+        Raises:
+            NotStreamable: If the selected format cannot be streamed.
+        """
+        info = ydl.extract_info(video_url, download=False)
+        check_streamable(info)
+        success = ydl.dl(pipe.path, info)
+        if isinstance(success, tuple):
+            success = success[0]
+        if not success:
+            raise yt_dlp.utils.DownloadError('The stream was not downloaded.')
+
+    def download(self,
+                 video: dict,
+                 ydl_opts: dict,
+                 fname: str,
+                 pipe: Optional[PipeUpload] = None) -> Union[bool, str]:
         """Download the video.
 
         Args:
             video: Video to download.
-            ydl_opts: Options for youtube-dl.
+            ydl_opts: Options of this download for youtube-dl, on top of the
+                options of the run (see `ydl_params`).
             fname: Filename to save the video to.
+            pipe: Download into this pipe instead of `fname`.
 
         Returns:
-            True if the video was downloaded.
+            True if the video was downloaded, 'not available' if the video
+            does not exist anymore, otherwise the class of the error (see
+            `classify_error`).
+
+        Raises:
+            NotStreamable: If `pipe` is given but the selected format of the
+                video cannot be streamed.
         """
         logger.debug(f'🚀 (CURRENT DOWNLOAD) -> File: {fname}; YT title: '
                      f'{video["title"]}; YT URL: {video["url"]}')
 
         try:
-            if self.no_logs:
-                with _suppress_stdout_stderr():
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download(video['url'])
-            else:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download(video['url'])
+            with profiling.span('download', _id=video['_id']):
+                if pipe:
+                    download = functools.partial(self._stream_download,
+                                                 pipe=pipe)
+                elif self.dash:
+                    download = functools.partial(self._download_streams,
+                                                 bandwidth=self.bandwidth)
+                else:
+                    download = lambda ydl, url: ydl.download(url)  # noqa
+                if self.no_logs:
+                    with _suppress_stdout_stderr():
+                        with self.ydl_pool.get(**ydl_opts) as ydl, \
+                                self._download_slot(ydl):
+                            download(ydl, video['url'])
+                else:
+                    with self.ydl_pool.get(**ydl_opts) as ydl, \
+                            self._download_slot(ydl):
+                        download(ydl, video['url'])
 
         except yt_dlp.utils.DownloadError as e:
             logger.error(f'❌ Failed to download! ERROR message: {e}')
             logger.error(f'❌ Skipping ({video["url"]})...')
+            error_class = classify_error(e)
+            self.breakers.record_failure(video['channel_name'], error_class)
+            if self.autoscaler and error_class == RATE_LIMIT:
+                self.autoscaler.throttled(DOWNLOAD)
 
             if 'Private video' in str(e) or 'Video unavailable' in str(e):
                 return 'not available'
@@ -270,41 +795,175 @@ class ArchiveYouTube:
                     'Running out of local disk space! Terminating the job...')
                 raise OSError('No space left on device!')
 
-            return
+            return error_class
+        self.breakers.record_success(video['channel_name'])
         return True
 
+    def stream_video(self, video: dict, ydl_opts: dict, md: dict,
+                     identifier: str, fname: str) -> Optional[tuple]:
+        """Download a video straight into its archive.org upload.
+
+        Args:
+            video: Video to stream.
+            ydl_opts: Options of this download for youtube-dl.
+            md: Metadata for the video.
+            identifier: Identifier for the video.
+            fname: Filename of the video in the item.
+
+        Returns:
+            None if the selected format cannot be streamed or the stream
+            failed with a transient error (the video has to be downloaded to
+            disk instead). Otherwise, a tuple of the result
+            of the download (see `download`), the MD5 digest of the streamed
+            file and the upload response (see `upload`).
+        """
+        identifier = self.target_identifier(video, identifier)
+        if identifier is None:
+            return True, None, 200
+        logger.debug(f'🚀 (CURRENT STREAM) -> File: {fname}; Identifier: '
+                     f'{identifier}; YT URL: {video["url"]}')
+        upload = MultipartUpload(identifier,
+                                 Path(fname).name,
+                                 md,
+                                 size_hint=video.get('filesize_approx'))
+        finished = {}
+
+        def _record_size(d: dict) -> None:
+            if d.get('status') == 'finished':
+                finished['size'] = d.get('downloaded_bytes')
+
+        # A pipe cannot be rewound: yt-dlp must not retry (it would restart
+        # the download from the first byte into the same pipe).
+        ydl_opts = {
+            **ydl_opts, 'nopart': True,
+            'overwrites': True,
+            'retries': 0,
+            'fragment_retries': 0,
+            'progress_hooks':
+            [*ydl_opts.get('progress_hooks', []), _record_size]
+        }
+        with PipeUpload(upload,
+                        self.stream_part_size,
+                        self.bandwidth,
+                        on_upload=self._upload_progress()) as pipe:
+            try:
+                is_downloaded = self.download(video, ydl_opts, fname, pipe)
+            except NotStreamable as e:
+                logger.debug(f'Cannot stream {video["_id"]} ({e}) '
+                             'Downloading it to disk instead...')
+                return None
+            if is_downloaded == TRANSIENT:
+                # Leaving the block aborts the multipart upload.
+                logger.debug(f'The stream of {video["_id"]} failed. '
+                             'Downloading it to disk instead...')
+                return None
+            if is_downloaded is not True:
+                return is_downloaded, None, None
+            with profiling.span('upload', _id=video['_id']):
+                return True, pipe.md5, pipe.finish(finished.get('size'))
+
     @staticmethod
-    def upload(video: dict, md: dict, identifier: str,
-               fname: str) -> Optional[int]:
-        """Upload the video.
+    def target_identifier(video: dict,
+                          identifier: str,
+                          md5: Optional[str] = None) -> Optional[str]:
+        """Return the identifier of the item to upload a video to.
 
         Args:
             video: Video to upload.
-            md: Metadata for the video.
             identifier: Identifier for the video.
-            fname: Filename of the video.
+            md5: MD5 digest of the file, if known.
 
         Returns:
-            int: ID of the uploaded video.
+            The identifier, a random one if the identifier is taken by another
+            uploader, or None if the video is already archived.
         """
-        logger.debug(f'Upload metadata: {md}')
         identifier = identifier.replace(' ', '').strip()
         cur_metadata = get_item(identifier).item_metadata
         if cur_metadata.get('metadata'):
             archive_email = os.getenv('ARCHIVE_USER_EMAIL')
+            archived_md5s = [
+                x.get('md5') for x in cur_metadata.get('files', [])
+            ]
+            if md5 and md5 in archived_md5s:
+                logger.debug(f'An identical file of {video["_id"]} is already '
+                             f'archived in {identifier}...')
+                return None
             if cur_metadata['metadata']['uploader'] != archive_email:
                 identifier = str(uuid.uuid4())
             else:
                 logger.debug(f'{video["_id"]} is already uploaded...')
-                return 200
+                return None
+        return identifier
+
+    def _upload_progress(self) -> Optional[Callable[[int], None]]:
+        """Return a callback that feeds uploaded bytes to the autoscaler as
+        they are read (like `Autoscaler.progress_hook` for downloads)."""
+        if self.autoscaler:
+            return functools.partial(self.autoscaler.add_bytes, UPLOAD)
+        return None
+
+    @staticmethod
+    def upload(
+            video: dict,
+            md: dict,
+            identifier: str,
+            fname: str,
+            md5: Optional[str] = None,
+            bandwidth: Optional[BandwidthManager] = None,
+            on_read: Optional[Callable[[int], None]] = None) -> Optional[int]:
+        """Upload the video.
+
+        Args:
+            video: Video to upload.
+            md: Metadata for the video.
+            identifier: Identifier for the video.
+            fname: Filename of the video.
+            md5: MD5 digest of the file computed during the download. When
+                given, it is sent as the `Content-MD5` header so archive.org
+                verifies the upload without the file being hashed again.
+            bandwidth: Bandwidth manager to pace the upload with.
+            on_read: Called with the size of every read of the file, as it
+                is uploaded.
+
+        Returns:
+            int: ID of the uploaded video.
+        """
+        logger.debug(f'Upload metadata: {md}')
+        identifier = ArchiveYouTube.target_identifier(video, identifier, md5)
+        if identifier is None:
+            return 200
 
         logger.debug(f'🚀 (CURRENT UPLOAD) -> File: {fname}; Identifier: '
                      f'{identifier}; YT title: {video["title"]}; YT URL: '
                      f'{video["url"]}')
 
+        with contextlib.ExitStack() as stack:
+            files = [fname]
+            if bandwidth or on_read:
+                files = {
+                    Path(fname).name:
+                    stack.enter_context(ThrottledFile(fname, bandwidth,
+                                                      on_read))
+                }
+            upload_kwargs = {'files': files, 'metadata': md}
+            if md5:
+                upload_kwargs['headers'] = {'Content-MD5': md5}
+            return ArchiveYouTube._upload_with_retries(
+                video, identifier, upload_kwargs)[0]
+
+    @staticmethod
+    def _upload_with_retries(
+            video: dict, identifier: str,
+            upload_kwargs: dict) -> Tuple[Optional[Union[int, str]], str]:
+        """Upload to an identifier, retrying on rate limits and taken
+        down identifiers.
+
+        Returns:
+            tuple: (status code or error message, identifier uploaded to)
+        """
         r = None
         try:
-            r = upload(identifier, files=[fname], metadata=md)
+            r = upload(identifier, **upload_kwargs)
         except requests.exceptions.HTTPError as e:
             if 'Slow Down' in str(e) or 'reduce your request rate' in str(e):
                 logger.error(f'❌ Error with video: {video}')
@@ -314,32 +973,158 @@ class ArchiveYouTube:
                 logger.debug('Trying to upload again...')
 
                 try:
-                    r = upload(identifier, files=[fname], metadata=md)
+                    r = upload(identifier, **upload_kwargs)
                 except requests.exceptions.HTTPError as e:
                     logger.error('❌ Failed again!')
                     logger.error(f'❌ ERROR message: {e}')
 
                     try:
                         identifier = str(uuid.uuid4())
-                        r = upload(identifier, files=[fname], metadata=md)
+                        r = upload(identifier, **upload_kwargs)
                     except requests.exceptions.HTTPError as e:
                         logger.error(f'❌ ERROR message: {e}')
                         logger.error('❌ Failed all attempts to upload! '
                                      'Skipping...')
-                        return str(e)
+                        return str(e), identifier
             elif 'been taken offline' in str(e):
                 identifier = f'{identifier}-{str(uuid.uuid4())[:4]}'
                 try:
-                    r = upload(identifier, files=[fname], metadata=md)
+                    r = upload(identifier, **upload_kwargs)
                 except requests.exceptions.HTTPError as e:
                     logger.error(f'❌ ERROR message: {e}')
             else:
-                return str(e)
+                return str(e), identifier
 
         if r:
             status_code = r[0].status_code
-            return status_code
+            return status_code, identifier
+        return None, identifier
+
+    def upload_bundle(self, entries: list) -> None:
+        """Upload bundled videos as the files of one item, and record the
+        item in each video's state.
+
+        Args:
+            entries: `BundleEntry` of videos of the same channel and period.
+        """
+        first = entries[0].video
+        label = self.bundler.label(first)
+        identifier = f'{self.clean_fname(first["channel_name"])[:80]}_' \
+            f'{label}_videos'
+        cur_metadata = get_item(identifier).item_metadata
+        archived = []
+        if cur_metadata.get('metadata'):
+            if cur_metadata['metadata'].get('uploader') != os.getenv(
+                    'ARCHIVE_USER_EMAIL'):
+                identifier = f'{identifier}-{str(uuid.uuid4())[:8]}'
+            else:
+                archived_md5s = [
+                    x.get('md5') for x in cur_metadata.get('files', [])
+                ]
+                archived = [
+                    x for x in entries
+                    if x.video.get('md5') and x.video['md5'] in archived_md5s
+                ]
+                entries = [x for x in entries if x not in archived]
+
+        for entry in archived:
+            logger.debug(f'{entry.video["_id"]} is already uploaded to '
+                         f'{identifier}...')
+            self.update_video(entry.video,
+                              *entry.backend,
+                              uploaded=True,
+                              item=identifier,
+                              failures=0,
+                              next_attempt_at=None)
+            Path(entry.fname).unlink(missing_ok=True)
+        if not entries:
+            return
+
+        logger.debug(f'🚀 (CURRENT BUNDLE UPLOAD) -> {len(entries)} files; '
+                     f'Identifier: {identifier}')
+        metadata = item_metadata(first['channel_name'], label)
+        headers = {'x-archive-size-hint': str(sum(x.size for x in entries))}
+        with contextlib.ExitStack() as stack:
+            files = []
+            for entry in entries:
+                body = entry.fname
+                if self.bandwidth or self.autoscaler:
+                    body = stack.enter_context(
+                        ThrottledFile(body, self.bandwidth,
+                                      self._upload_progress()))
+                files.append((Path(entry.fname).name, body,
+                              file_metadata(entry.md)))
+            with self._stage_slot(UPLOAD), profiling.span('upload_bundle',
+                                                          _id=identifier):
+                # The first file creates the item (and settles its
+                # identifier). The others are then added one at a time, so a
+                # failed file does not fail the files that were uploaded.
+                name, body, file_md = files[0]
+                resp, identifier = self._upload_with_retries(
+                    first, identifier, {
+                        'files': [{
+                            'name': (name, body),
+                            **file_md
+                        }],
+                        'metadata': metadata,
+                        'headers': headers,
+                        'queue_derive': len(files) == 1
+                    })
+                results = [resp]
+                item = get_item(identifier) if resp == 200 else None
+                for i, (name, body, file_md) in enumerate(files[1:], 2):
+                    if not item:
+                        results.append(resp)
+                        continue
+                    try:
+                        r = item.upload_file(body,
+                                             key=name,
+                                             metadata=metadata,
+                                             file_metadata=file_md,
+                                             headers=headers,
+                                             queue_derive=i == len(files))
+                        results.append(r.status_code)
+                    except requests.exceptions.RequestException as e:
+                        logger.error(f'❌ Failed to upload {name} to '
+                                     f'{identifier}! ERROR message: {e}')
+                        results.append(str(e))
+
+        for entry, result in zip(entries, results):
+            if result == 200:
+                self.update_video(entry.video,
+                                  *entry.backend,
+                                  uploaded=True,
+                                  item=identifier,
+                                  failures=0,
+                                  next_attempt_at=None)
+                Path(entry.fname).unlink(missing_ok=True)
+            else:
+                self.schedule_retry(entry.video, classify_error(result),
+                                    *entry.backend)
+                if not self.keep_failed_uploads:
+                    Path(entry.fname).unlink(missing_ok=True)
+        uploaded = results.count(200)
+        if uploaded:
+            logger.debug(f'✅ Uploaded {uploaded} videos to {identifier}!')
+        if uploaded < len(entries):
+            logger.error(f'❌ Could not upload {len(entries) - uploaded} '
+                         f'videos of the bundle {identifier}!')
+            logger.error('❌ Request response: '
+                         f'{next(x for x in results if x != 200)}.')
+
+    def flush_bundles(self, max_age: Optional[float] = None) -> None:
+        """Upload the bundles that are still waiting for more videos.
 
+        Args:
+            max_age: Only upload the bundles started at least this many
+                seconds ago.
+        """
+        if not self.bundler:
+            return
+        for entries in self.bundler.drain(max_age):
+            self.upload_bundle(entries)
+
+    @profiling.profiled('process_video')
     def process_video(self, video: dict, mongodb: bool, jsonbin: bool,
                       col: Optional[Collection], jb: Optional[JSONBin],
                       bin_id: Optional[str]) -> None:
@@ -351,7 +1136,7 @@ class ArchiveYouTube:
             jsonbin: Whether to save to JSONBin.
             col: MongoDB collection to save to.
             jb: JSONBin instance to save to.
-            bin_id: JSONBin ID to save to.
+            bin_id: JSONBin index bin ID.
         """
         if self.ignore_video_ids:
             if video['_id'] in self.ignore_video_ids:
@@ -363,21 +1148,40 @@ class ArchiveYouTube:
             logger.debug('Refreshing the database...')
             mongodb, jsonbin, col, jb, bin_id, self._data = self.load_data()
 
+        if not self.breakers.allow(video['channel_name']):
+            logger.debug(f'Skipped {video["_id"]} (the circuit of '
+                         f'{video["channel_name"]} is open)...')
+            return
+        try:
+            self._process_video(video, mongodb, jsonbin, col, jb)
+        finally:
+            # Outcomes that are neither a download success nor a counted
+            # failure (e.g. skip list, permanent errors) must not leave a
+            # half-open circuit waiting for its probe.
+            self.breakers.release(video['channel_name'])
+
+    def _process_video(self, video: dict, mongodb: bool, jsonbin: bool,
+                       col: Optional[Collection],
+                       jb: Optional[JSONBin]) -> None:
         _id, title, md, identifier = self.create_metadata(video)
-        f_suffix = self.get_video_extension(video['url'])
+        try:
+            f_suffix = self.stored_extension(video) or \
+                self.get_video_extension(video['url'])
+        except yt_dlp.utils.DownloadError as e:
+            logger.error(f'❌ Failed to extract {video["url"]}! ERROR '
+                         f'message: {e}')
+            error_class = classify_error(e)
+            self.breakers.record_failure(video['channel_name'], error_class)
+            self.schedule_retry(video, error_class, mongodb, jsonbin, col, jb)
+            return
         if f_suffix == 'not available':
-            if mongodb:
-                col.update_one({'_id': _id}, {
-                    '$set': {
-                        'downloaded': 'not available',
-                        'uploaded': 'not available'
-                    }
-                })
-            elif jsonbin:
-                with self._lock:
-                    video['downloaded'] = 'not available'
-                    video['uploaded'] = 'not available'
-                    jb.update_bin(bin_id, self._data)
+            self.update_video(video,
+                              mongodb,
+                              jsonbin,
+                              col,
+                              jb,
+                              downloaded='not available',
+                              uploaded='not available')
             return
         fname = f'{title}{f_suffix}'
 
@@ -386,73 +1190,105 @@ class ArchiveYouTube:
                 logger.debug(f'Skipped {video} (skip list)...')
                 return
 
-        ydl_opts = {'outtmpl': fname, 'format': 'best'}
-
-        if self.no_logs:
-            ydl_opts.update({
-                'quiet': True,
-                'no_warnings': True,
-                'noprogress': True,
-                'verbose': False,
-                'logtostderr': True
-            })
-
-        if self.cookies_file:
-            ydl_opts.update({'cookiefile': self.cookies_file})
-
-        if self.use_aria2c:
-            ydl_opts.update({'external_downloader': 'aria2c'})
+        hasher = IncrementalHasher(('md5', 'sha1') if self.sha1 else ('md5',))
+        hooks = []
+        if self.autoscaler:
+            hooks.append(self.autoscaler.progress_hook(DOWNLOAD))
+        if self.bandwidth:
+            hooks.append(self.bandwidth.progress_hook())
+        ydl_opts = {'outtmpl': fname, 'progress_hooks': [hasher, *hooks]}
 
         if video['downloaded'] and not video['uploaded']:
             if not Path(fname).exists():
                 video['downloaded'] = False
 
+        streamed = None
         if not video['downloaded']:
-            is_downloaded = self.download(video, ydl_opts, fname)
-            if not is_downloaded:
-                return
+            with self._stage_slot(DOWNLOAD):
+                if self.stream and not (self.bundler and self.bundler.accepts(
+                        video.get('filesize_approx'))):
+                    streamed = self.stream_video(
+                        video, {'progress_hooks': hooks}, md, identifier,
+                        fname)
+                if streamed:
+                    is_downloaded, streamed_md5, resp = streamed
+                else:
+                    is_downloaded = self.download(video, ydl_opts, fname)
 
             if is_downloaded == 'not available':
-                if mongodb:
-                    col.update_one({'_id': _id}, {
-                        '$set': {
-                            'downloaded': 'not available',
-                            'uploaded': 'not available'
-                        }
-                    })
-                elif jsonbin:
-                    with self._lock:
-                        video['downloaded'] = 'not available'
-                        video['uploaded'] = 'not available'
-                        jb.update_bin(bin_id, self._data)
+                self.update_video(video,
+                                  mongodb,
+                                  jsonbin,
+                                  col,
+                                  jb,
+                                  downloaded='not available',
+                                  uploaded='not available')
                 return
 
-            if mongodb:
-                col.update_one({'_id': _id}, {'$set': {'downloaded': True}})
-            elif jsonbin:
-                with self._lock:
-                    video['downloaded'] = True
-                    jb.update_bin(bin_id, self._data)
+            if is_downloaded is not True:
+                self.schedule_retry(video, is_downloaded, mongodb, jsonbin,
+                                    col, jb)
+                return
+
+            if streamed:
+                digests = {'md5': streamed_md5}
+            else:
+                digests = hasher.digests(fname) or {}
+            self.update_video(video,
+                              mongodb,
+                              jsonbin,
+                              col,
+                              jb,
+                              downloaded=True,
+                              md5=digests.get('md5'),
+                              sha1=digests.get('sha1'))
 
             logger.debug('✅ Downloaded!')
             time.sleep(3)
 
         if not video['uploaded']:
-            resp = self.upload(video, md, identifier, fname)
+            if not streamed and self.bundler and Path(fname).exists():
+                size = Path(fname).stat().st_size
+                if self.bundler.accepts(size):
+                    entries = self.bundler.add(
+                        BundleEntry(video, md, fname, size,
+                                    (mongodb, jsonbin, col, jb)))
+                    if entries:
+                        self.upload_bundle(entries)
+                    return
+
+            if not streamed:
+                with self._stage_slot(UPLOAD), profiling.span('upload',
+                                                              _id=_id):
+                    resp = self.upload(video,
+                                       md,
+                                       identifier,
+                                       fname,
+                                       md5=video.get('md5'),
+                                       bandwidth=self.bandwidth,
+                                       on_read=self._upload_progress())
 
             if resp == 200:
-                if mongodb:
-                    col.update_one({'_id': _id}, {'$set': {'uploaded': True}})
-                elif jsonbin:
-                    with self._lock:
-                        video['uploaded'] = True
-                        jb.update_bin(bin_id, self._data)
+                self.update_video(video,
+                                  mongodb,
+                                  jsonbin,
+                                  col,
+                                  jb,
+                                  uploaded=True,
+                                  failures=0,
+                                  next_attempt_at=None)
                 logger.debug('✅ Uploaded!')
                 Path(fname).unlink(missing_ok=True)
 
             else:
                 logger.error(f'❌ Could not upload {video}!')
                 logger.error(f'❌ Request response: {resp}.')
+                if self.autoscaler and any(
+                        x in str(resp)
+                        for x in ['Slow Down', 'reduce your request rate']):
+                    self.autoscaler.throttled(UPLOAD)
+                self.schedule_retry(video, classify_error(resp), mongodb,
+                                    jsonbin, col, jb)
                 if not self.keep_failed_uploads:
                     Path(fname).unlink(missing_ok=True)
                 else:
@@ -461,6 +1297,75 @@ class ArchiveYouTube:
                             [f'{k}: {v}' for k, v in md.items()])
                         print('-' * 80, '\n', md_str, '\n', '-' * 80)
 
+    def _start_services(self) -> None:
+        """Start the background services of a run and size the worker
+        pool."""
+        if self.bandwidth:
+            self.bandwidth.start()
+
+        if not self.multithreading:
+            return
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if self.autoscale:
+            self.autoscaler = Autoscaler({
+                DOWNLOAD: self.download_limits,
+                UPLOAD: self.upload_limits
+            })
+            self.autoscaler.start()
+            self.threads = self.autoscaler.max_workers
+        elif self.threads:
+            if self.threads > max_workers:
+                self.threads = max_workers
+                logger.warning(
+                    'The selected number of threads exceeds the '
+                    'recommended number of maximum workers. Falling back '
+                    f'to the default value: {max_workers}')
+        else:
+            self.threads = max_workers
+
+    def _stop_services(self) -> None:
+        if self.autoscaler:
+            self.autoscaler.stop()
+        if self.bandwidth:
+            self.bandwidth.stop()
+        self.ydl_pool.close()
+
+    def _process_all(self, refs: Iterable[VideoRef], input_dict: dict,
+                     total: Optional[int]) -> None:
+        """Process videos, concurrently when multithreading.
+
+        Args:
+            refs: The videos to process. May be a generator that blocks
+                until more work is available.
+            input_dict: The backend arguments of `process_ref`.
+            total: Number of videos, if known (for the progress bar).
+        """
+        def _process(item: tuple) -> None:
+            ref, submitted_at = item
+            profiling.record('queued',
+                             submitted_at,
+                             time.perf_counter(),
+                             _id=ref._id)
+            self.process_ref(ref, **input_dict)
+
+        try:
+            if not self.multithreading:
+                for ref in tqdm(refs, total=total, desc='Videos'):
+                    self.process_ref(ref=ref, **input_dict)
+                return
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.threads) as executor:
+                queue_ = ((x, time.perf_counter()) for x in refs)
+                for _ in tqdm(_bounded_map(executor, _process, queue_,
+                                           self.threads * 2),
+                              total=total,
+                              desc='Videos'):
+                    pass
+        finally:
+            # Also after an error (e.g. a full disk): the bundled videos are
+            # already downloaded.
+            self.flush_bundles()
+
     def run(self) -> None:
         """Run the job."""
         signal.signal(signal.SIGINT, self.keyboard_interrupt_handler)
@@ -468,7 +1373,7 @@ class ArchiveYouTube:
         if self.no_logs:
             logger.remove()
 
-        mongodb, jsonbin, col, jb, bin_id, data = self.load_data()
+        mongodb, jsonbin, col, jb, bin_id, data = self.load_data(sweep=True)
         self._data = data
 
         if not data:
@@ -486,28 +1391,77 @@ class ArchiveYouTube:
             'bin_id': bin_id
         }
 
-        if self.multithreading:
-            iterators = [
-                itertools.repeat(x, len(self._data))
-                for x in input_dict.values()
-            ]
-            max_workers = min(32, (os.cpu_count() or 1) + 4)
-            if self.threads:
-                if self.threads > max_workers:
-                    self.threads = max_workers
-                    logger.warning(
-                        'The selected number of threads exceeds the '
-                        'recommended number of maximum workers. Falling back '
-                        f'to the default value: {max_workers}')
+        self._start_services()
+        try:
+            self._process_all(data, input_dict, total=len(data))
+        finally:
+            self._stop_services()
 
-            with concurrent.futures.ThreadPoolExecutor(
-                    max_workers=self.threads) as executor:
-                _ = list(
-                    tqdm(executor.map(self.process_video, self._data,
-                                      *iterators),
-                         total=len(data),
-                         desc='Videos'))
+    def sync(self, channels: list) -> None:
+        """Scan channels for new videos and archive them in the same run.
 
-        else:
-            for video in tqdm(data, desc='Videos'):
-                self.process_video(video=video, **input_dict)
+        The pending videos are queued first. The channels are then scanned
+        one after the other on a background thread, and the new videos of
+        each channel are queued as soon as its scan is done, so archiving
+        starts right away instead of after the whole scan. The backend
+        clients and the loaded state are shared by the scan and the
+        workers.
+
+        Args:
+            channels: List of (channel name, channel URL) tuples.
+        """
+        signal.signal(signal.SIGINT, self.keyboard_interrupt_handler)
+
+        if self.no_logs:
+            logger.remove()
+
+        mongodb, jsonbin, col, jb, bin_id, data = self.load_data(sweep=True)
+        self._data = data
+        input_dict = {
+            'mongodb': mongodb,
+            'jsonbin': jsonbin,
+            'col': col,
+            'jb': jb,
+            'bin_id': bin_id
+        }
+        if self.specific_channel:
+            channels = [x for x in channels if x[0] == self.specific_channel]
+
+        work = queue.Queue()
+        for ref in data:
+            work.put(ref)
+
+        def _scan() -> None:
+            try:
+                for channel_name, channel_url in channels:
+                    logger.debug(f'Scanning {channel_name}...')
+                    try:
+                        new = CreateCollection(channel_name,
+                                               channel_url,
+                                               no_logs=self.no_logs,
+                                               cookies_file=self.cookies_file,
+                                               col=col,
+                                               jb=jb).create_collection()
+                    except (subprocess.CalledProcessError, ValueError) as e:
+                        logger.error(f'❌ Failed to scan {channel_name}: {e}')
+                        continue
+                    for record in new or []:
+                        work.put(VideoRef.from_record(record))
+                feeds.http_cache().flush()
+            finally:
+                work.put(None)
+
+        def _refs() -> Iterator[VideoRef]:
+            while True:
+                ref = work.get()
+                if ref is None:
+                    return
+                yield ref
+
+        self._start_services()
+        scanner = threading.Thread(target=_scan, name='scanner', daemon=True)
+        scanner.start()
+        try:
+            self._process_all(_refs(), input_dict, total=None)
+        finally:
+            self._stop_services()
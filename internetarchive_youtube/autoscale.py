@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Throughput-driven concurrency limits for the download and upload stages."""
+
+import collections
+import contextlib
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+DOWNLOAD = 'download'
+UPLOAD = 'upload'
+
+# An added worker has to improve the throughput by at least this much to be
+# kept.
+MIN_IMPROVEMENT = 0.05
+
+
+class AdaptiveLimiter:
+    """A semaphore whose limit can be changed while it is in use."""
+
+    def __init__(self, name: str, limit: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of the slots for the enclosed block."""
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify()
+
+    def resize(self, limit: int) -> None:
+        """Change the limit. Slots in use above a lower limit are not
+        interrupted; they are just not handed out again."""
+        with self._cond:
+            self.limit = limit
+            self._cond.notify_all()
+
+
+class StageController:
+    """Hill-climbs the concurrency limit of one stage.
+
+    The throughput of the stage is measured over a sliding window. While the
+    stage is saturated, a worker is added; if the next measurement shows that
+    it improved the throughput, another one is added, otherwise it is
+    removed again and the limit is held until the next probe. Throttling
+    errors halve the limit immediately.
+    """
+
+    def __init__(self,
+                 name: str,
+                 floor: int,
+                 ceiling: int,
+                 window: float = 60,
+                 probe_every: int = 4) -> None:
+        """Initialize the controller.
+
+        Args:
+            name: Name of the stage.
+            floor: Minimum concurrency.
+            ceiling: Maximum concurrency.
+            window: Length of the throughput window, in seconds.
+            probe_every: Number of held ticks before adding a worker again.
+        """
+        self.name = name
+        self.floor = floor
+        self.ceiling = ceiling
+        self.window = window
+        self.probe_every = probe_every
+        self.limiter = AdaptiveLimiter(name, floor)
+        self._samples = collections.deque()
+        self._throttled = False
+        self._last_rate = None
+        self._grew = False
+        self._held_ticks = 0
+        self._lock = threading.Lock()
+
+    def add_bytes(self, n: int) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), n))
+
+    def throttled(self) -> None:
+        with self._lock:
+            self._throttled = True
+
+    def rate(self) -> float:
+        """Return the throughput of the stage, in bytes per second."""
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return sum(n for _, n in self._samples) / self.window
+
+    def _set_limit(self, limit: int, reason: str) -> None:
+        limit = max(self.floor, min(self.ceiling, limit))
+        if limit != self.limiter.limit:
+            logger.debug(f'Concurrency of {self.name}: {self.limiter.limit} '
+                         f'-> {limit} ({reason}).')
+            self.limiter.resize(limit)
+
+    def tick(self) -> None:
+        """Measure the throughput and adjust the limit."""
+        rate = self.rate()
+        with self._lock:
+            throttled, self._throttled = self._throttled, False
+        limit = self.limiter.limit
+        saturated = self.limiter.in_flight >= limit
+
+        if throttled:
+            self._set_limit(limit // 2, 'throttled')
+            self._grew = False
+        elif self._grew:
+            if self._last_rate and rate < self._last_rate * (1 +
+                                                              MIN_IMPROVEMENT):
+                self._set_limit(limit - 1, 'no improvement')
+                self._grew = False
+            elif saturated and limit < self.ceiling:
+                self._set_limit(limit + 1, 'improving')
+            else:
+                self._grew = False
+        else:
+            self._held_ticks += 1
+            if saturated and limit < self.ceiling and (
+                    self._last_rate is None
+                    or self._held_ticks >= self.probe_every):
+                self._set_limit(limit + 1, 'probing')
+                self._grew = True
+                self._held_ticks = 0
+        self._last_rate = rate
+
+
+class Autoscaler:
+    """Runs one `StageController` per stage on a background thread."""
+
+    def __init__(self, limits: dict, interval: float = 30) -> None:
+        """Initialize the autoscaler.
+
+        Args:
+            limits: Mapping of stage name to a (floor, ceiling) tuple.
+            interval: Seconds between two adjustments.
+        """
+        self.interval = interval
+        self.stages = {
+            name: StageController(name, floor, ceiling)
+            for name, (floor, ceiling) in limits.items()
+        }
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def max_workers(self) -> int:
+        """The number of threads needed to reach every stage's ceiling."""
+        return sum(x.ceiling for x in self.stages.values())
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop,
+                                        name='autoscaler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            for controller in self.stages.values():
+                controller.tick()
+
+    def slot(self, stage: str):
+        """Return a context manager holding a slot of the stage."""
+        return self.stages[stage].limiter.slot()
+
+    def add_bytes(self, stage: str, n: int) -> None:
+        self.stages[stage].add_bytes(n)
+
+    def throttled(self, stage: str) -> None:
+        self.stages[stage].throttled()
+
+    def progress_hook(self, stage: str):
+        """Return a yt-dlp progress hook that feeds the stage throughput."""
+        seen = {}
+
+        def hook(d: dict) -> None:
+            path = d.get('tmpfilename') or d.get('filename')
+            downloaded: Optional[int] = d.get('downloaded_bytes')
+            if path is None or downloaded is None:
+                return
+            self.add_bytes(stage, max(0, downloaded - seen.get(path, 0)))
+            seen[path] = downloaded
+
+        return hook
+
+
+def parse_limits(value: str) -> tuple:
+    """Parse a `FLOOR:CEILING` command line value."""
+    floor, _, ceiling = value.partition(':')
+    floor = int(floor)
+    ceiling = int(ceiling or floor)
+    if not 1 <= floor <= ceiling:
+        raise ValueError(f'Invalid concurrency limits: {value}')
+    return floor, ceiling
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Process-wide bandwidth shaping for the download and upload workers."""
+
+import collections
+import contextlib
+import io
+import threading
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+# Seconds over which the actual download/upload rates are measured.
+RATE_WINDOW = 10
+
+
+class TokenBucket:
+    """A token bucket that may go into debt: `consume` takes the bytes right
+    away and then waits until the debt is paid."""
+
+    def __init__(self, rate: float) -> None:
+        """Initialize the bucket.
+
+        Args:
+            rate: Bytes per second. One second worth of bytes can burst.
+        """
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.rate,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, n: int) -> None:
+        """Take `n` bytes from the bucket, waiting until they are available."""
+        with self._lock:
+            self._refill()
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class _Meter:
+    """Measures a transfer rate over the last `RATE_WINDOW` seconds."""
+
+    def __init__(self) -> None:
+        self._samples = collections.deque()
+        self._lock = threading.Lock()
+
+    def add(self, n: int) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), n))
+
+    def rate(self) -> float:
+        cutoff = time.monotonic() - RATE_WINDOW
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return sum(n for _, n in self._samples) / RATE_WINDOW
+
+
+class ThrottledFile(io.FileIO):
+    """A file opened for reading whose reads are paced by a
+    `BandwidthManager`, and/or reported to a callback as they happen."""
+
+    def __init__(self,
+                 path: str,
+                 manager: Optional['BandwidthManager'] = None,
+                 on_read: Optional[Callable[[int], None]] = None) -> None:
+        super().__init__(path, 'rb')
+        self._manager = manager
+        self._on_read = on_read
+
+    def _consumed(self, n: int) -> None:
+        if self._manager:
+            self._manager.consume_upload(n)
+        if self._on_read:
+            self._on_read(n)
+
+    def read(self, size: int = -1) -> bytes:
+        data = super().read(size)
+        self._consumed(len(data))
+        return data
+
+    def readinto(self, b) -> Optional[int]:
+        n = super().readinto(b)
+        self._consumed(n or 0)
+        return n
+
+
+class BandwidthManager:
+    """Shares download (ingress) and upload (egress) bandwidth between all
+    the workers of the process.
+
+    Uploads are paced directly, by reading the uploaded files through
+    `ThrottledFile`. Downloads are paced by yt-dlp: every active download
+    gets an equal share of the download budget as its `ratelimit`, and the
+    shares are rebalanced whenever a download starts or finishes (and every
+    second while downloading). When a total ceiling is set, each direction
+    is guaranteed half of it and may borrow whatever the other direction is
+    not currently using, so neither can starve the other.
+    """
+
+    def __init__(self,
+                 download_limit: Optional[int] = None,
+                 upload_limit: Optional[int] = None,
+                 total_limit: Optional[int] = None,
+                 report_interval: float = 60) -> None:
+        """Initialize the manager.
+
+        Args:
+            download_limit: Download ceiling, in bytes per second.
+            upload_limit: Upload ceiling, in bytes per second.
+            total_limit: Ceiling of downloads and uploads combined, in bytes
+                per second.
+            report_interval: Seconds between two usage log messages.
+        """
+        self.download_limit = download_limit
+        self.upload_limit = upload_limit
+        self.total_limit = total_limit
+        self.report_interval = report_interval
+        self._upload_bucket = TokenBucket(
+            upload_limit) if upload_limit else None
+        self._total_bucket = TokenBucket(total_limit) if total_limit else None
+        # The rate of `_total_bucket` is the upload share of the total.
+        self._download_meter = _Meter()
+        self._upload_meter = _Meter()
+        self._downloads = []
+        self._streams = {}
+        self._last_rebalance = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._report_loop,
+                         name='bandwidth-report',
+                         daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.log_usage()
+
+    def _report_loop(self) -> None:
+        while not self._stop.wait(self.report_interval):
+            self.log_usage()
+
+    def _share(self, other_rate: float) -> float:
+        """Return the share of the total left by the other direction."""
+        return self.total_limit - min(other_rate, self.total_limit / 2)
+
+    def download_budget(self) -> Optional[float]:
+        """Return the bytes per second available to all downloads."""
+        budget = self.download_limit
+        if self.total_limit:
+            share = self._share(self._upload_meter.rate())
+            budget = min(budget, share) if budget else share
+        return budget
+
+    def _rebalance(self) -> None:
+        budget = self.download_budget()
+        self._last_rebalance = time.monotonic()
+        if self._total_bucket:
+            self._total_bucket.rate = self._share(self._download_meter.rate())
+        if not budget or not self._downloads:
+            return
+        # Every stream of a download is paced by its `ratelimit`.
+        streams = sum(self._streams.get(id(x), 1) for x in self._downloads)
+        share = int(budget / streams)
+        for params in self._downloads:
+            params['ratelimit'] = share
+
+    @contextlib.contextmanager
+    def download_slot(self, ydl_params: dict):
+        """Register an active download for the enclosed block.
+
+        Args:
+            ydl_params: The `params` dict of the `YoutubeDL` instance doing
+                the download. Its `ratelimit` is updated in place, which
+                yt-dlp picks up on the next block it downloads.
+        """
+        with self._lock:
+            self._downloads.append(ydl_params)
+            self._rebalance()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._downloads = [
+                    x for x in self._downloads if x is not ydl_params
+                ]
+                self._streams.pop(id(ydl_params), None)
+                ydl_params.pop('ratelimit', None)
+                self._rebalance()
+
+    def set_streams(self, ydl_params: dict, streams: int) -> None:
+        """Set the number of streams that a registered download fetches in
+        parallel (e.g. the video and audio of a merged format), so that
+        their `ratelimit` is a share of the budget per stream.
+
+        Args:
+            ydl_params: The `params` dict registered with `download_slot`.
+            streams: The number of parallel streams.
+        """
+        with self._lock:
+            self._streams[id(ydl_params)] = streams
+            self._rebalance()
+
+    def progress_hook(self):
+        """Return a yt-dlp progress hook that accounts the downloaded bytes."""
+        seen = {}
+
+        def hook(d: dict) -> None:
+            path = d.get('tmpfilename') or d.get('filename')
+            downloaded = d.get('downloaded_bytes')
+            if path is None or downloaded is None:
+                return
+            n = max(0, downloaded - seen.get(path, 0))
+            seen[path] = downloaded
+            self._download_meter.add(n)
+            if time.monotonic() - self._last_rebalance > 1:
+                with self._lock:
+                    self._rebalance()
+
+        return hook
+
+    def consume_upload(self, n: int) -> None:
+        """Wait until `n` bytes may be uploaded, and account them."""
+        if self._upload_bucket:
+            self._upload_bucket.consume(n)
+        if self._total_bucket:
+            if time.monotonic() - self._last_rebalance > 1:
+                with self._lock:
+                    self._rebalance()
+            self._total_bucket.consume(n)
+        self._upload_meter.add(n)
+
+    def open(self, path: str) -> ThrottledFile:
+        """Open a file to upload, paced by this manager."""
+        return ThrottledFile(path, self)
+
+    def usage(self) -> dict:
+        """Return the current rates and the share of each ceiling in use."""
+        down = self._download_meter.rate()
+        up = self._upload_meter.rate()
+        usage = {'download_rate': down, 'upload_rate': up}
+        for name, rate, limit in [('download', down, self.download_limit),
+                                  ('upload', up, self.upload_limit),
+                                  ('total', down + up, self.total_limit)]:
+            if limit:
+                usage[f'{name}_usage'] = rate / limit
+        return usage
+
+    def log_usage(self) -> None:
+        usage = self.usage()
+        message = (f'Bandwidth: download {usage["download_rate"] / 1e6:.2f} '
+                   f'MB/s, upload {usage["upload_rate"] / 1e6:.2f} MB/s')
+        caps = [
+            f'{name} {usage[f"{name}_usage"]:.0%}'
+            for name in ('download', 'upload', 'total')
+            if f'{name}_usage' in usage
+        ]
+        if caps:
+            message += f' (of the cap: {", ".join(caps)})'
+        logger.info(message)
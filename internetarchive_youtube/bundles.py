@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Bundling of small videos into multi-file archive.org items.
+
+Every item costs an existence check, the creation of the item, a derive
+task and a share of the upload rate limit, whatever the size of its file.
+For channels with many short videos, the videos under a size threshold are
+instead collected per channel and period (e.g. month) after they are
+downloaded, and each group is uploaded as the files of one item, with a
+single derive task queued with its last file. The metadata of each video is
+stored as the file-level metadata of its file.
+"""
+
+import threading
+import time
+from typing import Optional
+
+PERIODS = {'month': 6, 'year': 4}
+DEFAULT_PERIOD = 'month'
+# A group is uploaded as soon as it reaches either limit.
+BUNDLE_MAX_FILES = 50
+BUNDLE_MAX_BYTES = 2 * 1024**3
+# Bytes of downloads that may wait on disk in all the groups together. Past
+# it, the largest group is uploaded right away.
+BUNDLE_MAX_PENDING = 4 * 1024**3
+# Seconds kept at the end of a run with a time limit to upload the bundles
+# that are still waiting (at most a quarter of the run).
+FLUSH_MARGIN = 15 * 60
+# Fields of the metadata of a video that are set at the item level.
+ITEM_FIELDS = ['collection', 'mediatype', 'subject', 'language']
+
+
+class BundleEntry:
+    """A downloaded video waiting to be uploaded in a bundle."""
+    __slots__ = ('video', 'md', 'fname', 'size', 'backend')
+
+    def __init__(self, video: dict, md: dict, fname: str, size: int,
+                 backend: tuple) -> None:
+        self.video = video
+        self.md = md
+        self.fname = fname
+        self.size = size
+        self.backend = backend
+
+
+def period_label(upload_date: str, period: str = DEFAULT_PERIOD) -> str:
+    """Return the period of an upload date (`YYYYMMDD`), e.g. `2022-05`."""
+    date = upload_date[:PERIODS[period]]
+    return '-'.join(x for x in (date[:4], date[4:6]) if x)
+
+
+def item_metadata(channel_name: str, label: str) -> dict:
+    """Return the item-level metadata of a bundle."""
+    return {
+        'collection': 'opensource_movies',
+        'mediatype': 'movies',
+        'title': f'{channel_name} videos ({label})',
+        'description':
+        f'Videos of {channel_name} published in {label}. The metadata of '
+        'each video is stored in the metadata of its file.',
+        'subject': channel_name,
+        'language': 'eng',
+        'date': label
+    }
+
+
+def file_metadata(md: dict) -> dict:
+    """Return the file-level metadata of a bundled video from its item
+    metadata (see `ArchiveYouTube.create_metadata`)."""
+    return {k: v for k, v in md.items() if k not in ITEM_FIELDS}
+
+
+class Bundler:
+    """Groups downloaded videos per channel and period until a group is
+    ready to be uploaded."""
+
+    def __init__(self,
+                 max_size: int,
+                 period: str = DEFAULT_PERIOD,
+                 max_pending: int = BUNDLE_MAX_PENDING) -> None:
+        """Initialize the bundler.
+
+        Args:
+            max_size: Videos smaller than this (in bytes) are bundled.
+            period: Period of the videos of a bundle (`month` or `year`).
+            max_pending: Bytes that may wait in all the groups together.
+        """
+        self.max_size = max_size
+        self.period = period
+        self.max_pending = max_pending
+        self._groups = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def accepts(self, size: Optional[int]) -> bool:
+        """Return True if a video of this size is bundled (an unknown size
+        is accepted, to be checked again once downloaded)."""
+        return (size or 0) < self.max_size
+
+    def label(self, video: dict) -> str:
+        """Return the period of the bundle of a video."""
+        return period_label(video['upload_date'], self.period)
+
+    def _pop(self, key: tuple) -> list:
+        entries = self._groups.pop(key)['entries']
+        self._pending -= sum(x.size for x in entries)
+        return entries
+
+    def add(self, entry: BundleEntry) -> Optional[list]:
+        """Add a video to its group.
+
+        Returns:
+            The entries of a group to upload now (it is then removed): the
+            group of the video if it is full, or the largest group if the
+            groups hold more than `max_pending` bytes. Otherwise None.
+        """
+        key = (entry.video['channel_name'], self.label(entry.video))
+        with self._lock:
+            group = self._groups.setdefault(key, {
+                'created_at': time.time(),
+                'entries': []
+            })
+            group['entries'].append(entry)
+            self._pending += entry.size
+            if len(group['entries']) >= BUNDLE_MAX_FILES or sum(
+                    x.size for x in group['entries']) >= BUNDLE_MAX_BYTES:
+                return self._pop(key)
+            if self._pending > self.max_pending:
+                return self._pop(
+                    max(self._groups,
+                        key=lambda k: sum(
+                            x.size for x in self._groups[k]['entries'])))
+        return None
+
+    def drain(self, max_age: Optional[float] = None) -> list:
+        """Remove the groups that are waiting, regardless of their size.
+
+        Args:
+            max_age: Only remove the groups created at least this many
+                seconds ago.
+
+        Returns:
+            A list of groups (lists of entries).
+        """
+        now = time.time()
+        with self._lock:
+            keys = [
+                k for k, v in self._groups.items()
+                if max_age is None or now - v['created_at'] >= max_age
+            ]
+            return [self._pop(k) for k in keys]
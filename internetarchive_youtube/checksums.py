@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Incremental file hashing while yt-dlp writes a download."""
+
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class IncrementalHasher:
+    """A yt-dlp progress hook that hashes files as they are being written.
+
+    On every progress update, only the bytes appended since the previous
+    update are read (while they are still in the page cache), so the digests
+    are ready as soon as the download finishes, without a second sequential
+    read of the file.
+    """
+
+    def __init__(self, algorithms: tuple = ('md5',)) -> None:
+        """Initialize the hook.
+
+        Args:
+            algorithms: Names of the `hashlib` algorithms to compute.
+        """
+        self.algorithms = algorithms
+        self._state = {}
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def _feed(self, path: str, read_path: Optional[str] = None) -> None:
+        """Hash the bytes of `read_path` that were appended since the last
+        call, keeping the state under `path`."""
+        offset, hashers = self._state.setdefault(
+            path, (0, [hashlib.new(x) for x in self.algorithms]))
+        try:
+            with open(read_path or path, 'rb') as f:
+                f.seek(offset)
+                while chunk := f.read(CHUNK_SIZE):
+                    offset += len(chunk)
+                    for hasher in hashers:
+                        hasher.update(chunk)
+        except FileNotFoundError:
+            return
+        self._state[path] = (offset, hashers)
+
+    def __call__(self, d: dict) -> None:
+        # The state is kept under the final filename, which every update
+        # has: the `finished` update of yt-dlp has no `tmpfilename`, and the
+        # `.part` file has been renamed to `filename` by then.
+        path = d.get('filename')
+        if not path:
+            return
+        with self._lock:
+            if d['status'] == 'downloading':
+                self._feed(path, read_path=d.get('tmpfilename'))
+            elif d['status'] == 'finished':
+                self._feed(path)
+                offset, hashers = self._state.pop(path)
+                self._digests[path] = (offset, {
+                    name: hasher.hexdigest()
+                    for name, hasher in zip(self.algorithms, hashers)
+                })
+            elif d['status'] == 'error':
+                self._state.pop(path, None)
+
+    def digests(self, fname: str) -> Optional[dict]:
+        """Return the digests of a finished download.
+
+        Args:
+            fname: The path of the downloaded file.
+
+        Returns:
+            A dict of algorithm name to hex digest, or None if the file was
+            not fully hashed (e.g. it was post-processed after the download).
+        """
+        with self._lock:
+            size, digests = self._digests.get(fname, (None, None))
+        path = Path(fname)
+        if digests is None or not path.exists() or path.stat().st_size != size:
+            return
+        return digests
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Failure classification and circuit breakers for the download stage."""
+
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+TRANSIENT = 'transient'
+RATE_LIMIT = 'rate_limit'
+PERMANENT = 'permanent'
+CHANNEL = 'channel'
+
+GLOBAL_KEY = '__global__'
+
+# Number of consecutive failures of one class before a breaker opens.
+# Permanent failures are specific to one video, so they never open it.
+DEFAULT_THRESHOLDS = {TRANSIENT: 5, RATE_LIMIT: 3, CHANNEL: 2}
+
+_PATTERNS = [
+    (RATE_LIMIT, [
+        'HTTP Error 429', 'Too Many Requests', "confirm you're not a bot",
+        'confirm you’re not a bot', 'rate-limited', 'rate limited'
+    ]),
+    (CHANNEL, [
+        'not made this video available in your country',
+        'not available in your country', 'This channel does not exist',
+        'account has been terminated', 'channel was removed',
+        'members-only content', 'Join this channel'
+    ]),
+    (PERMANENT, [
+        'Private video', 'Video unavailable', 'This video has been removed',
+        'copyright claim', 'Premieres in', 'This live event will begin'
+    ]),
+]
+
+
+def classify_error(error: object) -> str:
+    """Classify a download or extraction error.
+
+    Args:
+        error: The exception (or its message).
+
+    Returns:
+        One of `TRANSIENT`, `RATE_LIMIT`, `PERMANENT` or `CHANNEL`.
+    """
+    message = str(error)
+    for error_class, patterns in _PATTERNS:
+        if any(x.lower() in message.lower() for x in patterns):
+            return error_class
+    return TRANSIENT
+
+
+class _Breaker:
+    """The state of one circuit (closed, open or half-open)."""
+
+    def __init__(self) -> None:
+        self.failures = {}
+        self.open_until = None
+        self.probe_started = None
+        self.probe_thread = None
+
+    def enter(self, key: str, probe_timeout: float) -> str:
+        """Return 'closed', 'probe', 'open' or 'busy' (a probe is already in
+        flight)."""
+        now = time.time()
+        if self.open_until is None:
+            return 'closed'
+        if now < self.open_until:
+            return 'open'
+        if self.probe_started and now - self.probe_started < probe_timeout:
+            return 'busy'
+        self.probe_started = now
+        self.probe_thread = threading.get_ident()
+        logger.debug(f'Probing circuit "{key}" after the cooldown...')
+        return 'probe'
+
+
+class CircuitBreakers:
+    """Per-channel and global circuit breakers.
+
+    Rate-limit failures count against the global breaker (YouTube throttles
+    the whole runner, not one channel), all other failure classes count
+    against the breaker of the channel. After `cooldown` seconds, an open
+    breaker lets a single probe through: a success closes it again, a failure
+    re-opens it for another cooldown.
+
+    While a channel breaker is open, videos of that channel are skipped.
+    While the global breaker is open, workers wait for the cooldown instead,
+    since every channel would fail the same way.
+    """
+
+    def __init__(self,
+                 cooldown: float = 900,
+                 thresholds: Optional[dict] = None) -> None:
+        """Initialize the breakers.
+
+        Args:
+            cooldown: Seconds an open breaker waits before the next probe.
+            thresholds: Consecutive failures per class that open a breaker.
+        """
+        self.cooldown = cooldown
+        self.thresholds = thresholds or DEFAULT_THRESHOLDS
+        self._breakers = {}
+        self._cond = threading.Condition()
+
+    def _get(self, key: str) -> _Breaker:
+        return self._breakers.setdefault(key, _Breaker())
+
+    def allow(self, channel_name: str) -> bool:
+        """Check whether a video of a channel may be processed now.
+
+        Blocks while the global breaker is open.
+
+        Args:
+            channel_name: The channel of the video.
+
+        Returns:
+            False if the channel's breaker is open and the video should be
+            skipped, True otherwise.
+        """
+        with self._cond:
+            while True:
+                global_breaker = self._get(GLOBAL_KEY)
+                global_state = global_breaker.enter(GLOBAL_KEY, self.cooldown)
+                if global_state in ('closed', 'probe'):
+                    break
+                timeout = 30
+                if global_state == 'open':
+                    timeout = global_breaker.open_until - time.time()
+                self._cond.wait(timeout=max(timeout, 1))
+            channel_state = self._get(channel_name).enter(
+                channel_name, self.cooldown)
+            if channel_state in ('closed', 'probe'):
+                return True
+            if global_state == 'probe':
+                global_breaker.probe_started = None
+            return False
+
+    def record_success(self, channel_name: str) -> None:
+        """Close the breakers of a channel and the global breaker."""
+        with self._cond:
+            for key in (GLOBAL_KEY, channel_name):
+                if self._get(key).open_until is not None:
+                    logger.info(f'Circuit "{key}" is closed again.')
+                self._breakers[key] = _Breaker()
+            self._cond.notify_all()
+
+    def record_failure(self, channel_name: str, error_class: str) -> None:
+        """Count a failure and open the breaker once its threshold is hit.
+
+        Args:
+            channel_name: The channel of the failed video.
+            error_class: The class returned by `classify_error`.
+        """
+        if error_class == PERMANENT:
+            return
+        key = GLOBAL_KEY if error_class == RATE_LIMIT else channel_name
+        with self._cond:
+            breaker = self._get(key)
+            breaker.failures[error_class] = breaker.failures.get(
+                error_class, 0) + 1
+            if breaker.probe_started or breaker.failures[
+                    error_class] >= self.thresholds[error_class]:
+                breaker.open_until = time.time() + self.cooldown
+                breaker.probe_started = None
+                breaker.failures = {}
+                logger.warning(
+                    f'Circuit "{key}" is open after repeated {error_class} '
+                    f'failures. Pausing it for {self.cooldown:.0f} seconds...')
+            self._cond.notify_all()
+
+    def release(self, channel_name: str) -> None:
+        """End the probes started by this thread for a video that neither
+        succeeded nor failed a download (the next video may probe again)."""
+        with self._cond:
+            for key in (GLOBAL_KEY, channel_name):
+                breaker = self._breakers.get(key)
+                if breaker and breaker.probe_started and \
+                        breaker.probe_thread == threading.get_ident():
+                    breaker.probe_started = None
+            self._cond.notify_all()
@@ -3,18 +3,30 @@
 """Command line interface for Internetarchive-YouTube Sync."""
 
 import argparse
+import functools
 import io
 import json
 import os
 import random
+import shutil
 import signal
 import sys
+from datetime import datetime
 from pathlib import Path
 
-import requests
+import yt_dlp
+from tqdm import tqdm
+from yt_dlp.utils import format_bytes
 from dotenv import load_dotenv
+from internetarchive_youtube import feeds, planner, profiling
 from internetarchive_youtube.archive_youtube import ArchiveYouTube
+from internetarchive_youtube.autoscale import parse_limits
+from internetarchive_youtube.bundles import (DEFAULT_PERIOD, FLUSH_MARGIN,
+                                             PERIODS)
 from internetarchive_youtube.create_collection import CreateCollection
+from internetarchive_youtube.daemon import DEFAULT_STATUS_PORT, Daemon
+from internetarchive_youtube.transfer import (export_records, import_records,
+                                              iter_records, read_records)
 
 
 class TimeLimitReached(Exception):
@@ -32,6 +44,22 @@ def _alarm_handler(signum: int, _: object):
         'The GitHub action is about to die. Terminating the job safely...')
 
 
+def _rate(value: str) -> int:
+    """Parses a rate like `500K` or `4.2M` (bytes per second)."""
+    rate = yt_dlp.utils.parse_bytes(value)
+    if rate is None:
+        raise argparse.ArgumentTypeError(f'Invalid rate: {value}')
+    return rate
+
+
+def _size(value: str) -> int:
+    """Parses a size like `500M` or `2G` (bytes)."""
+    size = yt_dlp.utils.parse_bytes(value)
+    if size is None:
+        raise argparse.ArgumentTypeError(f'Invalid size: {value}')
+    return size
+
+
 def _opts() -> argparse.Namespace:
     """Parses the command line arguments."""
     parser = argparse.ArgumentParser()
@@ -90,6 +118,76 @@ def _opts() -> argparse.Namespace:
                         'enabled. Defaults to the optimal maximum number of '
                         'workers.',
                         type=int)
+    parser.add_argument('-as',
+                        '--autoscale',
+                        help='Adapt the number of concurrent downloads and '
+                        'uploads to the measured throughput (requires '
+                        '`--multithreading`; ignores `--threads`).',
+                        action='store_true')
+    parser.add_argument('--download-concurrency',
+                        help='Minimum and maximum concurrent downloads when '
+                        'autoscaling, as MIN:MAX (default: 1:16).',
+                        type=parse_limits,
+                        default='1:16')
+    parser.add_argument('--upload-concurrency',
+                        help='Minimum and maximum concurrent uploads when '
+                        'autoscaling, as MIN:MAX (default: 1:16).',
+                        type=parse_limits,
+                        default='1:16')
+    parser.add_argument('--max-download-rate',
+                        help='Maximum download rate of all the downloads '
+                        'combined, in bytes per second (e.g. 50K or 4.2M).',
+                        type=_rate)
+    parser.add_argument('--max-upload-rate',
+                        help='Maximum upload rate of all the uploads '
+                        'combined, in bytes per second (e.g. 50K or 4.2M).',
+                        type=_rate)
+    parser.add_argument('--max-total-rate',
+                        help='Maximum rate of all the downloads and uploads '
+                        'combined, in bytes per second (e.g. 50K or 4.2M).',
+                        type=_rate)
+    parser.add_argument('--dash',
+                        help='Download the best separate video and audio '
+                        'streams in parallel and merge them with ffmpeg, '
+                        'instead of the best single-file format.',
+                        action='store_true')
+    parser.add_argument('--max-height',
+                        help='Maximum height of the downloaded videos (e.g. '
+                        '1080).',
+                        type=int)
+    parser.add_argument('--max-filesize',
+                        help='Maximum size of each downloaded stream (e.g. '
+                        '500M or 2G). Falls back to the smallest format if '
+                        'no format is within the limit.',
+                        type=_size)
+    parser.add_argument('--fragment-concurrency',
+                        help='Number of fragments of each fragmented (DASH/'
+                        'HLS) download to fetch concurrently, independently '
+                        'of `--threads` (default: 1).',
+                        type=int,
+                        default=1)
+    parser.add_argument('--stream',
+                        help='Stream single-file downloads straight into '
+                        'archive.org multipart uploads, without writing them '
+                        'to disk. Formats that need merging are still '
+                        'downloaded to disk.',
+                        action='store_true')
+    parser.add_argument('--stream-part-size',
+                        help='Size of each part of a streamed upload (e.g. '
+                        '16M). Every stream holds up to 4 parts in memory '
+                        '(default: 16M).',
+                        type=_size,
+                        default='16M')
+    parser.add_argument('--bundle',
+                        help='Upload the videos smaller than this size (e.g. '
+                        '100M) as the files of one item per channel and '
+                        'period, instead of one item per video.',
+                        type=_size)
+    parser.add_argument('--bundle-period',
+                        help='Period of the videos of each bundle with '
+                        '`--bundle` (default: month).',
+                        choices=list(PERIODS),
+                        default=DEFAULT_PERIOD)
     parser.add_argument(
         '-k',
         '--keep-failed-uploads',
@@ -113,27 +211,103 @@ def _opts() -> argparse.Namespace:
                         '--cookies-file',
                         help='Path to the YouTube cookies file',
                         type=str)
-    return parser.parse_args()
+    parser.add_argument('-B',
+                        '--breaker-cooldown',
+                        help='Minutes to pause a channel after repeated '
+                        'download failures, or all channels after repeated '
+                        'rate-limit errors (default: 15).',
+                        type=float,
+                        default=15)
+    parser.add_argument('--sync',
+                        help='Scan the channels for new videos and archive '
+                        'them in the same run (i.e., `--create-collection` '
+                        'and archiving, overlapped).',
+                        action='store_true')
+    parser.add_argument('--daemon',
+                        help='Keep running: poll the channels for new videos '
+                        'on a schedule that adapts to how often each channel '
+                        'posts, and archive them continuously (ignores '
+                        '`--timeout`). Send SIGHUP to reload the channels '
+                        'list.',
+                        action='store_true')
+    parser.add_argument('--status-port',
+                        help='Port of the local status endpoint of '
+                        '`--daemon` (queue depth, in-flight videos, '
+                        'throughput), or 0 to disable it (default: 8733).',
+                        type=int,
+                        default=DEFAULT_STATUS_PORT)
+    parser.add_argument('--export',
+                        help='Export the state (every video record) of the '
+                        'backend to this gzip-compressed NDJSON file.',
+                        type=str)
+    parser.add_argument('--import',
+                        help='Import the records of a file written by '
+                        '`--export` into the backend, skipping the videos it '
+                        'already has (run it again to resume an interrupted '
+                        'import).',
+                        type=str,
+                        dest='import_file')
+    parser.add_argument('--plan',
+                        help='Forecast how the pending videos get archived '
+                        'with the current options (`--threads`, the rate '
+                        'ceilings, `--timeout`): videos per run, peak disk '
+                        'use and the time to clear the backlog of each '
+                        'channel. Nothing is downloaded.',
+                        action='store_true')
+    parser.add_argument('--plan-bandwidth',
+                        help='Download and upload bandwidth of the runner for '
+                        '`--plan`, in bytes per second (e.g. 20M), on top of '
+                        'the rate ceilings (default: 10M).',
+                        type=_rate,
+                        default='10M')
+    parser.add_argument('--plan-disk',
+                        help='Disk space available for downloads for '
+                        '`--plan` (e.g. 14G) (default: the free space of the '
+                        'current directory).',
+                        type=_size)
+    parser.add_argument('-R',
+                        '--report-failures',
+                        help='Show the videos that failed the most times and '
+                        'when they will be attempted again.',
+                        action='store_true')
+    parser.add_argument('-P',
+                        '--profile',
+                        help='Profile the run and write per-stage profiles '
+                        'and a Chrome trace timeline (trace.json) to this '
+                        'directory.',
+                        type=str)
+    parser.add_argument('--profile-mode',
+                        help='Profiler to use with `--profile`: a sampling '
+                        'profiler that covers all threads (default), or '
+                        'cProfile.',
+                        choices=[profiling.SAMPLE, profiling.CPROFILE],
+                        default=profiling.SAMPLE)
+    parser.add_argument('--sha1',
+                        help='Also compute the SHA1 digest of every download '
+                        'and store it in the database (MD5 is always '
+                        'computed).',
+                        action='store_true')
+    args = parser.parse_args()
+    if args.autoscale and not args.multithreading:
+        parser.error('`--autoscale` requires `--multithreading`')
+    return args
 
 
-def _create_collection(no_logs: bool = False) -> None:
-    """Creates a collection from the channels list.
+def _load_channels(channels: str) -> list:
+    """Loads the channels list.
 
     Args:
-        no_logs: Whether to print logs.
+        channels: The channels list: a file path, a file URL or raw text (see
+            `--channels-file` and `CHANNELS`).
+
+    Returns:
+        list: (channel name, channel URL) tuples, in random order.
     """
-    args = _opts()
-    if args.channels_file:
-        channels = args.channels_file
-    else:
-        channels = os.getenv('CHANNELS')
     if not channels:
         raise TypeError('`CHANNELS` cannot be empty!')
 
     if channels.startswith('http'):
-        resp = requests.get(channels, timeout=30)
-        resp.raise_for_status()
-        channels = resp.text
+        channels = feeds.http_cache().get(channels)
 
     elif Path(channels).exists():
         with open(channels) as f:
@@ -149,12 +323,140 @@ def _create_collection(no_logs: bool = False) -> None:
         ]
 
     random.shuffle(channels)
+    return channels
+
+
+def _create_collection(no_logs: bool = False) -> None:
+    """Creates a collection from the channels list.
+
+    Args:
+        no_logs: Whether to print logs.
+    """
+    args = _opts()
+    channels = _load_channels(args.channels_file or os.getenv('CHANNELS'))
 
     for channel in channels:
         if not no_logs:
             print(f'Current channel: {channel}')
         cc = CreateCollection(channel[0], channel[1], no_logs=no_logs, cookies_file=args.cookies_file)
         _ = cc.create_collection()
+    feeds.http_cache().flush()
+
+
+def _report_failures(no_logs: bool = False) -> None:
+    """Prints the videos that failed the most times.
+
+    Args:
+        no_logs: Whether to print logs.
+    """
+    videos = ArchiveYouTube(no_logs=no_logs).failure_report()
+    if not videos:
+        print('No failed videos!')
+        return
+    print('-' * 80)
+    for video in videos:
+        next_attempt = video.get('next_attempt_at')
+        if next_attempt:
+            next_attempt = datetime.fromtimestamp(next_attempt).isoformat(
+                ' ', 'minutes')
+        print(f'{video["_id"]} ({video["channel_name"]}): '
+              f'{video["failures"]} failure(s), last error: '
+              f'{video.get("last_error")}, next attempt: {next_attempt}')
+    print('-' * 80)
+
+
+def _export_state(path: str, no_logs: bool = False) -> None:
+    """Exports the state of the backend to a file.
+
+    Args:
+        path: The gzip-compressed NDJSON file to write.
+        no_logs: Whether to print logs.
+    """
+    mongodb, _, col, jb = ArchiveYouTube(no_logs=no_logs).connect_backend()
+    records = tqdm(iter_records(mongodb, col, jb),
+                   desc='Records',
+                   disable=no_logs)
+    n = export_records(path, records)
+    if not no_logs:
+        print(f'Exported {n} records to {path}')
+
+
+def _import_state(path: str, no_logs: bool = False) -> None:
+    """Imports a file written by `_export_state` into the backend.
+
+    Args:
+        path: The gzip-compressed NDJSON file to read.
+        no_logs: Whether to print logs.
+    """
+    mongodb, _, col, jb = ArchiveYouTube(no_logs=no_logs).connect_backend()
+    records = tqdm(read_records(path), desc='Records', disable=no_logs)
+    imported, skipped = import_records(records, mongodb, col, jb)
+    if not no_logs:
+        print(f'Imported {imported} records ({skipped} already existed)')
+
+
+def _plan(args: argparse.Namespace, ayt: ArchiveYouTube) -> None:
+    """Prints a forecast of how the pending videos get archived.
+
+    Args:
+        args: The command line arguments.
+        ayt: The job to plan.
+    """
+    threads = 1
+    if args.multithreading:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if args.autoscale:
+            threads = args.download_concurrency[1]
+        else:
+            threads = min(args.threads or max_workers, max_workers)
+    download_rate = min(args.max_download_rate or args.plan_bandwidth,
+                        args.plan_bandwidth)
+    upload_rate = min(args.max_upload_rate or args.plan_bandwidth,
+                      args.plan_bandwidth)
+    disk = args.plan_disk or shutil.disk_usage('.').free
+    timeout = None if args.daemon else args.timeout * 3600
+
+    result = planner.plan(ayt,
+                          threads,
+                          download_rate=download_rate,
+                          upload_rate=upload_rate,
+                          total_rate=args.max_total_rate,
+                          disk_budget=disk,
+                          timeout=timeout)
+    if not result:
+        print('No videos to process!')
+        return
+
+    videos, runs = result['videos'], result['runs']
+    estimated = sum(x.estimated for x in videos)
+    print('-' * 80)
+    print(f'Backlog: {len(videos)} videos, '
+          f'{format_bytes(sum(x.size for x in videos))} ({estimated} sizes '
+          'estimated)')
+    print(f'Assumptions: {threads} thread(s), download '
+          f'{format_bytes(download_rate)}/s, upload '
+          f'{format_bytes(upload_rate)}/s, disk {format_bytes(disk)}, '
+          f'runs of {args.timeout if timeout else "unlimited"} hours')
+    if runs:
+        print(f'Per run: ~{runs[0]["videos"]} videos, peak disk use '
+              f'{format_bytes(max(x["peak_disk"] for x in runs))}')
+        print(f'Runs to clear the backlog: {len(runs)} ('
+              f'{sum(x["seconds"] for x in runs) / 3600:.1f} hours of '
+              'runtime)')
+    if result['unfinished']:
+        print(f'Cannot be archived with these limits: '
+              f'{len(result["unfinished"])} videos (larger than the disk '
+              'space, or too long for one run)')
+    print('-' * 80)
+    print(f'{"Channel":<32} {"Videos":>8} {"Size":>12} {"Runs":>6} '
+          f'{"Hours":>8}')
+    for channel in result['channels']:
+        print(f'{channel["channel"][:32]:<32} {channel["videos"]:>8} '
+              f'{format_bytes(channel["size"]):>12} {channel["runs"]:>6} '
+              f'{channel["seconds"] / 3600:>8.1f}' +
+              (f' ({channel["unfinished"]} unfinished)'
+               if channel['unfinished'] else ''))
+    print('-' * 80)
 
 
 def main() -> None:
@@ -165,6 +467,20 @@ def main() -> None:
     signal.signal(signal.SIGALRM, _alarm_handler)
     timeout = int(args.timeout * 3600)
 
+    if args.profile:
+        profiling.enable(args.profile, mode=args.profile_mode)
+    try:
+        _main(args, timeout)
+    finally:
+        profiling.disable()
+
+
+def _main(args: argparse.Namespace, timeout: int) -> None:
+    """Runs the command selected by the command line arguments."""
+    # An explicit `--channels-file`, else `CHANNELS`, else the default file
+    # (resolved before the default is assigned to `args.channels_file`).
+    channels = args.channels_file or os.getenv('CHANNELS') or \
+        f'{Path.home()}/.yt_channels.txt'
     if not args.channels_file:
         args.channels_file = f'{Path.home()}/.yt_channels.txt'
         if not os.getenv('CHANNELS'):
@@ -196,6 +512,18 @@ def main() -> None:
             print(f'Channels list file path: {chs_file}')
         return
 
+    if args.report_failures:
+        _report_failures(no_logs=args.no_logs)
+        return
+
+    if args.export:
+        _export_state(args.export, no_logs=args.no_logs)
+        return
+
+    if args.import_file:
+        _import_state(args.import_file, no_logs=args.no_logs)
+        return
+
     if args.add_channel:
         if os.getenv('CHANNELS'):
             if not Path(os.environ['CHANNELS']).exists():
@@ -226,8 +554,13 @@ def main() -> None:
                 args.ignore_video_ids = f.read().strip()
         args.ignore_video_ids = args.ignore_video_ids.split(',')
 
+    ayt = None
     try:
-        signal.alarm(timeout)
+        if not args.daemon and not args.plan:
+            if args.bundle:
+                # Stop early enough to upload the bundles that are waiting.
+                timeout -= min(FLUSH_MARGIN, timeout // 4)
+            signal.alarm(timeout)
         ayt = ArchiveYouTube(prioritize=args.prioritize,
                              skip_list=args.skip_list,
                              force_refresh=args.force_refresh,
@@ -238,9 +571,36 @@ def main() -> None:
                              ignore_video_ids=args.ignore_video_ids,
                              use_aria2c=args.use_aria2c,
                              specific_channel=args.specific_channel,
-                             cookies_file=args.cookies_file)
-        ayt.run()
+                             cookies_file=args.cookies_file,
+                             sha1=args.sha1,
+                             breaker_cooldown=args.breaker_cooldown * 60,
+                             autoscale=args.autoscale,
+                             download_limits=args.download_concurrency,
+                             upload_limits=args.upload_concurrency,
+                             max_download_rate=args.max_download_rate,
+                             max_upload_rate=args.max_upload_rate,
+                             max_total_rate=args.max_total_rate,
+                             dash=args.dash,
+                             max_height=args.max_height,
+                             max_filesize=args.max_filesize,
+                             fragment_concurrency=args.fragment_concurrency,
+                             stream=args.stream,
+                             stream_part_size=args.stream_part_size,
+                             bundle_size=args.bundle,
+                             bundle_period=args.bundle_period)
+        if args.plan:
+            _plan(args, ayt)
+        elif args.daemon:
+            Daemon(ayt,
+                   functools.partial(_load_channels, channels),
+                   status_port=args.status_port).run()
+        elif args.sync:
+            ayt.sync(_load_channels(channels))
+        else:
+            ayt.run()
     except TimeLimitReached:
+        if ayt:
+            ayt.flush_bundles()
         return
 
 
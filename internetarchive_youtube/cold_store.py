@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Cold storage of finished video records.
+
+Videos that were uploaded, or that are not available, never need any more
+work, so their full records are moved out of the hot state (the `DATA`
+collection, or the channel shards with JSONBin), which then only holds
+actionable work. The cold store keeps just the `_id` and `COLD_FIELDS` of
+each of them, which is enough to know that a video was already handled.
+"""
+
+from typing import Iterable
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+ARCHIVED_COLLECTION = 'ARCHIVED'
+COLD_FIELDS = ['channel_name', 'uploaded', 'md5', 'item']
+FINISHED_QUERY = {
+    '$or': [{
+        'uploaded': True
+    }, {
+        'uploaded': 'not available'
+    }, {
+        'downloaded': 'not available'
+    }]
+}
+ID_BATCH_SIZE = 1000
+
+
+def is_finished(record: dict) -> bool:
+    """Return True if there is nothing left to do for a video."""
+    return record.get('uploaded') is True or 'not available' in (
+        record.get('downloaded'), record.get('uploaded'))
+
+
+def cold_record(record: dict) -> dict:
+    """Return the fields of a record that are kept in the cold store."""
+    return {
+        k: record[k]
+        for k in COLD_FIELDS if record.get(k) is not None
+    }
+
+
+def archived_collection(col: Collection) -> Collection:
+    """Return the cold collection next to a hot MongoDB collection."""
+    return col.database[ARCHIVED_COLLECTION]
+
+
+def archive_mongo(col: Collection, records: list) -> None:
+    """Move finished records from the hot collection to the cold one.
+
+    The cold copies are written before the hot records are deleted, so an
+    interrupted move leaves a record in both, which the next sweep repairs.
+
+    Args:
+        col: The hot MongoDB collection.
+        records: The finished records (at least `_id` and `COLD_FIELDS`).
+    """
+    if not records:
+        return
+    operations = [
+        UpdateOne({'_id': x['_id']}, {'$set': cold_record(x)}, upsert=True)
+        for x in records
+    ]
+    archived_collection(col).bulk_write(operations, ordered=False)
+    col.delete_many({'_id': {'$in': [x['_id'] for x in records]}})
+
+
+def sweep_mongo(col: Collection) -> int:
+    """Move every finished record still in the hot collection.
+
+    Args:
+        col: The hot MongoDB collection.
+
+    Returns:
+        The number of records moved.
+    """
+    moved = 0
+    batch = []
+    projection = {k: 1 for k in COLD_FIELDS}
+    for record in col.find(FINISHED_QUERY, projection):
+        batch.append(record)
+        if len(batch) >= ID_BATCH_SIZE:
+            archive_mongo(col, batch)
+            moved += len(batch)
+            batch = []
+    archive_mongo(col, batch)
+    return moved + len(batch)
+
+
+def known_ids_mongo(col: Collection, ids: Iterable[str]) -> set:
+    """Return which of the given video IDs are in the hot or cold store.
+
+    Only the `_id` index is read, in batches of `ID_BATCH_SIZE` IDs.
+
+    Args:
+        col: The hot MongoDB collection.
+        ids: The video IDs to check.
+
+    Returns:
+        The subset of `ids` that are already known.
+    """
+    ids = list(ids)
+    known = set()
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        query = {'_id': {'$in': ids[i:i + ID_BATCH_SIZE]}}
+        for collection in (col, archived_collection(col)):
+            known.update(x['_id'] for x in collection.find(query, {'_id': 1}))
+    return known
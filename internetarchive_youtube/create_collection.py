@@ -10,10 +10,14 @@ from typing import Optional
 
 import pymongo
 from loguru import logger
+from pymongo.collection import Collection
 from pymongo.database import Database
 from pymongo.errors import DuplicateKeyError
 
-from internetarchive_youtube.jsonbin_manager import JSONBin, NoDataToInclude
+from internetarchive_youtube import profiling
+from internetarchive_youtube import feeds
+from internetarchive_youtube.cold_store import known_ids_mongo
+from internetarchive_youtube.jsonbin_manager import JSONBin
 
 
 class InvalidChannelURLFormat(Exception):
@@ -27,7 +31,9 @@ class CreateCollection:
                  channel_name: str,
                  channel_url: str,
                  no_logs: bool = False,
-                 cookies_file: str = None) -> None:
+                 cookies_file: str = None,
+                 col: Optional[Collection] = None,
+                 jb: Optional[JSONBin] = None) -> None:
         """Initialize the class.
 
         Args:
@@ -35,11 +41,18 @@ class CreateCollection:
             channel_url (str): The URL of the channel.
             no_logs (bool, optional): Whether to disable logging. Defaults to
                 False.
+            cookies_file (str, optional): Path to a YouTube cookies file.
+            col (Collection, optional): MongoDB collection to reuse instead
+                of connecting again.
+            jb (JSONBin, optional): JSONBin instance to reuse (with its loaded
+                shards) instead of connecting again.
         """
         self.channel_name = channel_name
         self.channel_url = channel_url
         self.no_logs = no_logs
         self.cookies_file = cookies_file
+        self.col = col
+        self.jb = jb
 
     @staticmethod
     def mongodb_client() -> Database:
@@ -70,10 +83,18 @@ class CreateCollection:
             cmd_prefix = f'yt-dlp --cookies {self.cookies_file}'
         else:
             cmd_prefix = 'yt-dlp'
-        cmd = f'{cmd_prefix} {playlist_end} --get-filename -o ' \
+        # `ext` and `filesize_approx` are those of the `best` format, which is
+        # the one `ArchiveYouTube` downloads by default (the merged streams
+        # only keep videos without one from failing the scan).
+        cmd = f'{cmd_prefix} {playlist_end} -f best/bv*+ba ' \
+              '--get-filename -o ' \
               '\'{"upload_date": "%(upload_date)s", ' \
               '"title": "%(title)s", "url": ' \
               f'"{base_url}%(id)s", ' \
+              '"duration": %(duration|null)s, "ext": %(ext|null)j, ' \
+              '"filesize_approx": %(filesize_approx|null)s, ' \
+              '"is_live": %(is_live|null)j, ' \
+              '"availability": %(availability|null)j, ' \
               '"downloaded": false, "uploaded": false}, \' ' + \
               f'"{self.channel_url}"'
         return cmd
@@ -111,30 +132,44 @@ class CreateCollection:
             parsed.append(video)
         return parsed
 
-    def create_collection(self):
-        """Creates the collection."""
+    @profiling.profiled('create_collection')
+    def create_collection(self) -> Optional[list]:
+        """Creates the collection.
+
+        Returns:
+            list: The records that were added, if any.
+        """
         if self.no_logs:
             logger.remove()
 
-        existing_data = []
-        existing_ids = []
-        bin_id = None
+        existing_ids = set()
         skip_full_download = False
 
+        # With MongoDB, only the scanned IDs are looked up (in the hot and
+        # cold collections). With JSONBin, the IDs of the hot shards and of
+        # the cold stores are loaded once.
         if os.getenv('MONGODB_CONNECTION_STRING'):
-            db = self.mongodb_client()
-            existing_data = list(db['DATA'].find({}))
-            if existing_data:
-                existing_ids = [x.get('_id') for x in existing_data]
+            col = self.col
+            if col is None:
+                col = self.mongodb_client()['DATA']
 
         elif os.getenv('JSONBIN_KEY'):
-            jb = JSONBin(os.getenv('JSONBIN_KEY'))
-            try:
-                bin_id = jb.handle_collection_bins()
-                existing_data = jb.read_bin(bin_id)['record']
-                existing_ids = [x.get('_id') for x in existing_data]
-            except NoDataToInclude:
-                pass
+            jb = self.jb
+            if jb is None:
+                jb = JSONBin(os.getenv('JSONBIN_KEY'), no_logs=self.no_logs)
+            if jb.index_bin_id is None:
+                jb.load_shards()
+            existing_ids = jb.known_ids()
+
+        feed_ids = feeds.latest_video_ids(self.channel_url)
+        if feed_ids:
+            if os.getenv('MONGODB_CONNECTION_STRING'):
+                existing_ids = known_ids_mongo(col, feed_ids)  # noqa
+            if feed_ids[0] == feeds.stored_newest_id(self.channel_url) or all(
+                    x in existing_ids for x in feed_ids):
+                logger.debug(f'{self.channel_name} is up-to-date (no new '
+                             'videos in its feed)! Nothing to do...')
+                return
 
         cmd_last_ten = self.info_cmd(playlist_end='--playlist-end 10')
 
@@ -147,10 +182,14 @@ class CreateCollection:
         data = self.append_data(data)
 
         last_ten_ids = [x['_id'] for x in data]
+        if os.getenv('MONGODB_CONNECTION_STRING'):
+            existing_ids = known_ids_mongo(col, last_ten_ids)  # noqa
 
         if last_ten_ids and all(x in existing_ids for x in last_ten_ids):
             logger.debug(
                 f'{self.channel_name} is up-to-date! Nothing to do...')
+            if feed_ids:
+                feeds.store_newest_id(self.channel_url, feed_ids[0])
             return
         else:
             data = [x for x in data if x['_id'] not in existing_ids]
@@ -170,6 +209,8 @@ class CreateCollection:
                                text=True)
             data = json.loads(f'[{p.stdout.strip()[:-1]}]')
             data = self.append_data(data)
+            if os.getenv('MONGODB_CONNECTION_STRING'):
+                existing_ids = known_ids_mongo(col, [x['_id'] for x in data])
 
         data = [dict(x) for x in {tuple(d.items()) for d in data}]
 
@@ -180,16 +221,18 @@ class CreateCollection:
             json.dump(data, j, indent=4)
 
         if os.getenv('MONGODB_CONNECTION_STRING'):
-            data = [x for x in data if x['_id'] not in existing_ids]
+            inserted = []
             for video in data:
+                if video['_id'] in existing_ids:
+                    continue
                 try:
-                    db['DATA'].insert_one(video)  # noqa
+                    col.insert_one(video)  # noqa
                 except DuplicateKeyError:
                     continue
+                inserted.append(video)
+            data = inserted
 
         elif os.getenv('JSONBIN_KEY'):
-            if not bin_id:
-                bin_id = jb.handle_collection_bins(include_data=data)  # noqa
             data_to_add = []
             for video in data:
                 if video['_id'] in existing_ids:
@@ -197,8 +240,10 @@ class CreateCollection:
                 else:
                     data_to_add.append(video)
 
-            data = existing_data + data_to_add
-            jb.update_bin(bin_id, data)
+            jb.add_records(data_to_add)  # noqa
+            data = data_to_add
 
+        if feed_ids:
+            feeds.store_newest_id(self.channel_url, feed_ids[0])
         logger.debug('Finished updating the metadata database...')
         return data
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Long-running archiving, with channels polled on an adaptive schedule.
+
+The daemon loads the state and starts the services of `ArchiveYouTube` once,
+then keeps a fixed set of workers busy with a queue of pending videos. Every
+channel is polled for new videos on its own schedule: the poll interval is
+shortened after a poll that found new videos and lengthened after one that
+did not, so it follows how often the channel posts. Thanks to the feed check
+of `CreateCollection`, polling a channel that did not change is cheap.
+
+Send `SIGHUP` to reload the channels list, and `SIGINT`/`SIGTERM` to stop
+after the videos in progress.
+"""
+
+import collections
+import json
+import queue
+import random
+import signal
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional
+
+from loguru import logger
+
+from internetarchive_youtube import profiling
+from internetarchive_youtube.archive_youtube import ArchiveYouTube, VideoRef
+from internetarchive_youtube.create_collection import CreateCollection
+
+DEFAULT_POLL_INTERVAL = 3600
+MIN_POLL_INTERVAL = 15 * 60
+MAX_POLL_INTERVAL = 24 * 3600
+# Factors applied to the poll interval of a channel after a poll that found
+# new videos, and after a poll that did not.
+SPEEDUP = 0.5
+SLOWDOWN = 1.5
+# Seconds between two reloads of the pending videos from the backend (for
+# the videos whose retry delay is over).
+BACKLOG_REFRESH_INTERVAL = 15 * 60
+# Seconds a bundle of small videos may wait for more videos (see `--bundle`).
+BUNDLE_MAX_AGE = 3600
+# Seconds over which the throughput is measured.
+THROUGHPUT_WINDOW = 3600
+STATUS_HOST = '127.0.0.1'
+DEFAULT_STATUS_PORT = 8733
+TICK = 1
+
+
+class ChannelSchedule:
+    """The polling schedule of one channel."""
+
+    def __init__(self, name: str, url: str) -> None:
+        self.name = name
+        self.url = url
+        self.interval = DEFAULT_POLL_INTERVAL
+        self.next_poll_at = time.time()
+        self.last_poll_at = None
+        self.last_new_videos = None
+
+    def polled(self, new_videos: int) -> None:
+        """Schedule the next poll after a poll that found `new_videos`."""
+        factor = SPEEDUP if new_videos else SLOWDOWN
+        self.interval = min(MAX_POLL_INTERVAL,
+                            max(MIN_POLL_INTERVAL, self.interval * factor))
+        self.last_poll_at = time.time()
+        self.last_new_videos = new_videos
+        # Some jitter, so channels that were added together drift apart.
+        self.next_poll_at = self.last_poll_at + self.interval * \
+            random.uniform(0.9, 1.1)
+
+    def status(self) -> dict:
+        return {
+            'name': self.name,
+            'poll_interval': round(self.interval),
+            'next_poll_at': _isoformat(self.next_poll_at),
+            'last_poll_at': _isoformat(self.last_poll_at),
+            'last_new_videos': self.last_new_videos
+        }
+
+
+def _isoformat(ts: Optional[float]) -> Optional[str]:
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts).isoformat(' ', 'seconds')
+
+
+def serve_status(host: str, port: int,
+                 status: Callable[[], dict]) -> ThreadingHTTPServer:
+    """Serve a JSON status document over HTTP, on a background thread.
+
+    Args:
+        host: Address to listen on.
+        port: Port to listen on.
+        status: Returns the status document of each request.
+
+    Returns:
+        The server (call `shutdown` to stop it).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self) -> None:  # noqa
+            if self.path.rstrip('/') not in ('', '/status'):
+                self.send_error(404)
+                return
+            body = json.dumps(status(), indent=4).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:  # noqa
+            logger.debug(f'Status endpoint: {format % args}')
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever,
+                     name='status-server',
+                     daemon=True).start()
+    return server
+
+
+class Daemon:
+    """Runs an `ArchiveYouTube` job until it is stopped."""
+
+    def __init__(self,
+                 ayt: ArchiveYouTube,
+                 load_channels: Callable[[], list],
+                 status_port: Optional[int] = DEFAULT_STATUS_PORT) -> None:
+        """Initialize the daemon.
+
+        Args:
+            ayt: The job to run.
+            load_channels: Returns the list of (channel name, channel URL)
+                tuples to poll. Called on start and on `SIGHUP`.
+            status_port: Port of the local status endpoint (disabled if
+                None or 0).
+        """
+        self.ayt = ayt
+        self.load_channels = load_channels
+        self.status_port = status_port
+        self.schedules = {}
+        self._queue = queue.Queue()
+        self._active = set()
+        self._in_flight = 0
+        self._processed = 0
+        self._completed_at = collections.deque()
+        self._started_at = None
+        self._lock = threading.Lock()
+        self._backend = None
+        self._input_dict = None
+        self._next_refresh = 0
+        self._reload_requested = False
+        self._stopping = False
+        self._forced = False
+
+    def _sighup_handler(self, *_) -> None:
+        self._reload_requested = True
+
+    def _stop_handler(self, sig: int, frame) -> None:
+        if self._stopping:
+            # A second interrupt: stop right away.
+            self._forced = True
+            self.ayt.keyboard_interrupt_handler(sig, frame)
+        logger.warning('Stopping after the videos in progress (interrupt '
+                       'again to stop right away)...')
+        self._stopping = True
+
+    def reload_channels(self) -> None:
+        """Load the channels list, keeping the schedule of the channels
+        that were already polled."""
+        try:
+            channels = self.load_channels()
+        except Exception as e:  # noqa
+            logger.error(f'❌ Could not load the channels list: {e}')
+            return
+        if self.ayt.specific_channel:
+            channels = [
+                x for x in channels if x[0] == self.ayt.specific_channel
+            ]
+        schedules = {}
+        for name, url in channels:
+            schedule = self.schedules.get(name)
+            if schedule is None or schedule.url != url:
+                schedule = ChannelSchedule(name, url)
+            schedules[name] = schedule
+        added = len(schedules.keys() - self.schedules.keys())
+        removed = len(self.schedules.keys() - schedules.keys())
+        self.schedules = schedules
+        logger.info(f'Polling {len(schedules)} channels ({added} added, '
+                    f'{removed} removed).')
+
+    def submit(self, refs: Iterable[VideoRef]) -> int:
+        """Queue videos that are not already queued or in progress.
+
+        Returns:
+            The number of queued videos.
+        """
+        n = 0
+        for ref in refs:
+            with self._lock:
+                if ref._id in self._active:
+                    continue
+                self._active.add(ref._id)
+            self._queue.put((ref, time.perf_counter()))
+            n += 1
+        return n
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            ref, submitted_at = item
+            profiling.record('queued',
+                             submitted_at,
+                             time.perf_counter(),
+                             _id=ref._id)
+            with self._lock:
+                self._in_flight += 1
+            try:
+                self.ayt.process_ref(ref, **self._input_dict)
+            except Exception as e:  # noqa
+                logger.exception(f'❌ Failed to process {ref._id}: {e}')
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._processed += 1
+                    self._completed_at.append(time.time())
+                    self._active.discard(ref._id)
+
+    def poll(self, schedule: ChannelSchedule) -> None:
+        """Scan a channel for new videos, queue them and schedule the next
+        poll."""
+        _, _, col, jb = self._backend
+        logger.debug(f'Polling {schedule.name}...')
+        try:
+            new = CreateCollection(schedule.name,
+                                   schedule.url,
+                                   no_logs=self.ayt.no_logs,
+                                   cookies_file=self.ayt.cookies_file,
+                                   col=col,
+                                   jb=jb).create_collection() or []
+        except Exception as e:  # noqa
+            # Back off as after a poll without new videos, and keep polling
+            # the other channels.
+            logger.exception(f'❌ Failed to scan {schedule.name}: {e}')
+            new = []
+        schedule.polled(len(new))
+        if new:
+            n = self.submit(VideoRef.from_record(x) for x in new)
+            logger.info(f'Queued {n} new videos of {schedule.name}.')
+
+    def refresh_backlog(self) -> None:
+        """Queue the pending videos of the backend that are due."""
+        self._next_refresh = time.time() + BACKLOG_REFRESH_INTERVAL
+        try:
+            data = self.ayt.load_data(self._backend)[-1]
+        except Exception as e:  # noqa
+            logger.exception(f'❌ Failed to load the pending videos: {e}')
+            return
+        n = self.submit(data)
+        if n:
+            logger.info(f'Queued {n} pending videos.')
+
+    def status(self) -> dict:
+        """Return the status of the daemon."""
+        now = time.time()
+        with self._lock:
+            while self._completed_at and \
+                    self._completed_at[0] < now - THROUGHPUT_WINDOW:
+                self._completed_at.popleft()
+            window = min(THROUGHPUT_WINDOW, max(now - self._started_at, 60))
+            status = {
+                'started_at': _isoformat(self._started_at),
+                'queue_depth': self._queue.qsize(),
+                'in_flight': self._in_flight,
+                'processed': self._processed,
+                'videos_per_hour':
+                round(len(self._completed_at) * 3600 / window, 2)
+            }
+        if self.ayt.bandwidth:
+            status['bandwidth'] = self.ayt.bandwidth.usage()
+        status['channels'] = sorted(
+            (x.status() for x in list(self.schedules.values())),
+            key=lambda x: x['next_poll_at'])
+        return status
+
+    def _loop(self) -> None:
+        while not self._stopping:
+            if self._reload_requested:
+                self._reload_requested = False
+                self.reload_channels()
+            due = sorted((x for x in self.schedules.values()
+                          if x.next_poll_at <= time.time()),
+                         key=lambda x: x.next_poll_at)
+            for schedule in due:
+                if self._stopping or self._reload_requested:
+                    break
+                self.poll(schedule)
+            if not self._stopping and time.time() >= self._next_refresh:
+                self.refresh_backlog()
+            if not self._stopping:
+                try:
+                    self.ayt.flush_bundles(max_age=BUNDLE_MAX_AGE)
+                except Exception as e:  # noqa
+                    logger.exception(f'❌ Failed to upload the bundles: {e}')
+            time.sleep(TICK)
+
+    def run(self) -> None:
+        """Run until `SIGINT` or `SIGTERM`."""
+        ayt = self.ayt
+        signal.signal(signal.SIGINT, self._stop_handler)
+        signal.signal(signal.SIGTERM, self._stop_handler)
+        signal.signal(signal.SIGHUP, self._sighup_handler)
+
+        if ayt.no_logs:
+            logger.remove()
+
+        mongodb, jsonbin, col, jb, bin_id, data = ayt.load_data(sweep=True)
+        self._backend = (mongodb, jsonbin, col, jb)
+        self._input_dict = {
+            'mongodb': mongodb,
+            'jsonbin': jsonbin,
+            'col': col,
+            'jb': jb,
+            'bin_id': bin_id
+        }
+        self.reload_channels()
+
+        ayt._start_services()
+        workers = [
+            threading.Thread(target=self._work,
+                             name=f'worker-{i}',
+                             daemon=True)
+            for i in range(ayt.threads if ayt.multithreading else 1)
+        ]
+        for worker in workers:
+            worker.start()
+        self._started_at = time.time()
+
+        server = None
+        if self.status_port:
+            try:
+                server = serve_status(STATUS_HOST, self.status_port,
+                                      self.status)
+                logger.info('Status endpoint: '
+                            f'http://{STATUS_HOST}:{self.status_port}/status')
+            except OSError as e:
+                logger.warning(f'Could not start the status endpoint: {e}')
+
+        self.submit(data)
+        self._next_refresh = time.time() + BACKLOG_REFRESH_INTERVAL
+        try:
+            self._loop()
+        finally:
+            # Drop the queued videos (they stay pending in the backend), and
+            # let the workers finish the videos in progress.
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            for _ in workers:
+                self._queue.put(None)
+            if not self._forced:
+                for worker in workers:
+                    worker.join()
+                ayt.flush_bundles()
+            if server:
+                server.shutdown()
+            ayt._stop_services()
+            logger.info(f'Stopped after processing {self._processed} '
+                        'videos.')
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Cheap change detection for channels, with conditional HTTP requests.
+
+YouTube publishes an Atom feed of the latest videos of every channel. It is a
+few kilobytes, versus a `yt-dlp` subprocess that extracts the newest videos
+one by one, so it is fetched first: when the newest video in the feed is the
+one recorded at the last scan of the channel, or every video in the feed is
+already known, the channel has not changed and the scan can be skipped.
+
+All the requests go through one pooled session and a small on-disk cache
+that stores the `ETag`/`Last-Modified` validators of every fetched URL, so an
+unchanged feed (or channels list) costs a `304 Not Modified` response. The
+cache is written at most every `SAVE_INTERVAL` seconds, after a scan pass
+(see `ConditionalCache.flush`) and on exit, instead of after every change.
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+
+CACHE_FILE = Path.home() / '.cache' / 'internetarchive_youtube' / \
+    'http_cache.json'
+FEED_URL = 'https://www.youtube.com/feeds/videos.xml'
+POOL_SIZE = 16
+TIMEOUT = 30
+SAVE_INTERVAL = 60
+
+_CHANNEL_ID = re.compile(r'/channel/(UC[\w-]{22})')
+_USER = re.compile(r'youtube\.com/user/([^/?#]+)')
+_VIDEO_ID = re.compile(r'<yt:videoId>([\w-]+)</yt:videoId>')
+
+
+class ConditionalCache:
+    """GETs URLs with conditional requests, replaying the cached body on a
+    `304 Not Modified` response."""
+
+    def __init__(self, path: Path = CACHE_FILE) -> None:
+        """Initialize the cache.
+
+        Args:
+            path: JSON file to persist the cache to.
+        """
+        self.path = Path(path)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE,
+                                                pool_maxsize=POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        try:
+            with open(self.path) as j:
+                self._entries = json.load(j)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self) -> None:
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as j:
+                json.dump(self._entries, j)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.debug(f'Could not save the HTTP cache: {e}')
+
+    def _changed(self) -> None:
+        # Rewriting the whole file after every change would cost O(N) per
+        # fetch: save at most every `SAVE_INTERVAL` seconds instead.
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self._save()
+
+    def flush(self) -> None:
+        """Write the changes that are not saved yet."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def get(self, url: str) -> str:
+        """Return the body of a URL, fetched only if it changed.
+
+        Args:
+            url: The URL to fetch.
+
+        Returns:
+            The body of the response.
+        """
+        with self._lock:
+            entry = self._entries.get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        resp = self.session.get(url, headers=headers, timeout=TIMEOUT)
+        if resp.status_code == 304 and 'body' in entry:
+            return entry['body']
+        resp.raise_for_status()
+
+        if resp.headers.get('ETag') or resp.headers.get('Last-Modified'):
+            with self._lock:
+                self._entries[url] = {
+                    'etag': resp.headers.get('ETag'),
+                    'last_modified': resp.headers.get('Last-Modified'),
+                    'body': resp.text
+                }
+                self._changed()
+        return resp.text
+
+    def remember(self, key: str, value: str) -> None:
+        """Store a value that never changes (e.g. a resolved channel ID)."""
+        with self._lock:
+            self._entries[key] = {'body': value}
+            self._changed()
+
+    def recall(self, key: str) -> Optional[str]:
+        """Return a value stored with `remember`, if any."""
+        with self._lock:
+            return self._entries.get(key, {}).get('body')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def http_cache() -> ConditionalCache:
+    """Return the cache shared by the whole process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ConditionalCache()
+            atexit.register(_cache.flush)
+        return _cache
+
+
+def feed_url(channel_url: str) -> Optional[str]:
+    """Return the URL of the Atom feed of a YouTube channel.
+
+    Channel URLs with a channel ID or a legacy user name map to a feed
+    directly. Other channel URLs (handles, custom URLs) are resolved once by
+    reading the channel ID from the channel page, and the result is cached.
+
+    Args:
+        channel_url: URL of the channel.
+
+    Returns:
+        The feed URL, or None if the channel has no feed (e.g. it is not a
+        YouTube channel, or its ID could not be found).
+    """
+    if 'youtube.com' not in urlparse(channel_url).netloc:
+        return None
+    match = _CHANNEL_ID.search(channel_url)
+    if match:
+        return f'{FEED_URL}?channel_id={match.group(1)}'
+    match = _USER.search(channel_url)
+    if match:
+        return f'{FEED_URL}?user={match.group(1)}'
+
+    cache = http_cache()
+    key = f'channel_id:{channel_url}'
+    channel_id = cache.recall(key)
+    if not channel_id:
+        try:
+            resp = cache.session.get(channel_url, timeout=TIMEOUT)
+            resp.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.debug(f'Could not resolve {channel_url}: {e}')
+            return None
+        match = re.search(r'<link rel="canonical" href="[^"]*'
+                          r'/channel/(UC[\w-]{22})"', resp.text)
+        if not match:
+            return None
+        channel_id = match.group(1)
+        cache.remember(key, channel_id)
+    return f'{FEED_URL}?channel_id={channel_id}'
+
+
+def latest_video_ids(channel_url: str) -> list:
+    """Return the IDs of the latest videos of a channel, from its feed.
+
+    Args:
+        channel_url: URL of the channel.
+
+    Returns:
+        The video IDs, newest first, or an empty list if the feed is not
+        available.
+    """
+    url = feed_url(channel_url)
+    if not url:
+        return []
+    try:
+        return _VIDEO_ID.findall(http_cache().get(url))
+    except requests.exceptions.RequestException as e:
+        logger.debug(f'Could not fetch the feed of {channel_url}: {e}')
+        return []
+
+
+def stored_newest_id(channel_url: str) -> Optional[str]:
+    """Return the newest feed video ID of a channel at its last scan."""
+    return http_cache().recall(f'newest_id:{channel_url}')
+
+
+def store_newest_id(channel_url: str, video_id: str) -> None:
+    """Record the newest feed video ID of a channel after a scan."""
+    http_cache().remember(f'newest_id:{channel_url}', video_id)
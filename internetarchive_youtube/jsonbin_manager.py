@@ -1,13 +1,41 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import collections
+import concurrent.futures
+import hashlib
+import re
+import threading
+from typing import Iterator, Optional
+
 import requests
 
+from internetarchive_youtube.cold_store import cold_record, is_finished
+from internetarchive_youtube.profiling import TracedLock
+
 BASE_URL = 'https://api.jsonbin.io/v3'
 COLLECTION_NAME = 'yt_archive_sync_collection'
+DATA_BIN_NAME = 'DATA'
+INDEX_BIN_NAME = 'INDEX'
+SHARD_PREFIX = 'DATA_'
+ARCHIVED_PREFIX = 'ARCHIVED_'
+SHARD_READ_WORKERS = 8
+BINS_PAGE_SIZE = 10
 TIMEOUT = 30
 
 
+def bin_name(prefix: str, channel_name: str) -> str:
+    """Return the name of a bin of a channel.
+
+    Bin names are sent in an HTTP header, so they must be ASCII: the channel
+    name is reduced to its ASCII letters and digits, with a short hash to
+    keep names unique (the index maps the real channel name to the bin).
+    """
+    digest = hashlib.sha1(channel_name.encode()).hexdigest()[:8]
+    name = re.sub(r'[^A-Za-z0-9_-]+', '_', channel_name).strip('_')[:64]
+    return f'{prefix}{name}_{digest}' if name else f'{prefix}{digest}'
+
+
 class NoDataToInclude(Exception):
     """Raised when there is no data to include."""
 
@@ -32,6 +60,19 @@ class JSONBin:
         """
         self.jsonbin_key = jsonbin_key
         self.no_logs = no_logs
+        self.index_bin_id = None
+        self._collection_id = None
+        self._index = {}
+        self._archived_index = {}
+        self._shards = {}
+        self._archived = {}
+        self._archived_loaded = False
+        self._records = {}
+        self._shard_locks = collections.defaultdict(
+            lambda: TracedLock(threading.RLock(), 'jsonbin shard'))
+        self._lock = TracedLock(threading.Lock(), 'jsonbin index')
+        self._index_write_lock = TracedLock(threading.Lock(),
+                                            'jsonbin index write')
 
     @property
     def _auth(self) -> dict:
@@ -45,8 +86,64 @@ class JSONBin:
             raise JSONBinError(data['message'])
         return data
 
+    def _find_collection(self) -> str:
+        """Return the collection ID, creating the collection if needed."""
+        if not self.jsonbin_key:
+            raise MissingMasterKey("The secret JSONBIN token can't be None!")
+
+        collections_ = self._check(
+            requests.get(f'{BASE_URL}/c', headers=self._auth, timeout=TIMEOUT))
+
+        for col in collections_:
+            if col.get('collectionMeta', {}).get('name') == COLLECTION_NAME:
+                return col['record']
+
+        data = self._check(
+            requests.post(f'{BASE_URL}/c',
+                          json={},
+                          headers={
+                              **self._auth, 'X-Collection-Name': COLLECTION_NAME
+                          },
+                          timeout=TIMEOUT))
+        return data['record']
+
+    def _list_bins(self, collection_id: str) -> Iterator[dict]:
+        """Yield every bin of the collection, following the pages of the
+        listing (JSONBin returns a few bins per page, newest first)."""
+        url = f'{BASE_URL}/c/{collection_id}/bins'
+        bins = self._check(requests.get(url, headers=self._auth,
+                                        timeout=TIMEOUT))
+        while bins:
+            yield from bins
+            if len(bins) < BINS_PAGE_SIZE:
+                return
+            bins = self._check(
+                requests.get(f'{url}/{bins[-1]["record"]}',
+                             headers=self._auth,
+                             timeout=TIMEOUT))
+
+    def _find_bin(self, collection_id: str, name: str) -> Optional[str]:
+        """Return the ID of the bin called `name` in the collection, if any."""
+        for b in self._list_bins(collection_id):
+            if b.get('snippetMeta', {}).get('name') == name:
+                return b['record']
+
+    def _create_bin(self, collection_id: str, name: str, data) -> str:
+        """Create a named bin in the collection and return its ID."""
+        data = self._check(
+            requests.post(f'{BASE_URL}/b',
+                          json=data,
+                          headers={
+                              **self._auth,
+                              'Content-Type': 'application/json',
+                              'X-Bin-Name': name[:128],
+                              'X-Collection-Id': collection_id,
+                          },
+                          timeout=TIMEOUT))
+        return data['metadata']['id']
+
     def handle_collection_bins(self, include_data=None) -> str:
-        """Return the DATA bin ID, creating the collection/bin if needed.
+        """Return the legacy DATA bin ID, creating the collection/bin if needed.
 
         Args:
             include_data: Initial records to store when creating a new bin.
@@ -54,61 +151,288 @@ class JSONBin:
         Returns:
             The bin ID string.
         """
-        if not self.jsonbin_key:
-            raise MissingMasterKey("The secret JSONBIN token can't be None!")
-
-        # --- Find or create the collection ---
-        collections = self._check(
-            requests.get(f'{BASE_URL}/c', headers=self._auth, timeout=TIMEOUT))
-
-        collection_id = None
-        for col in collections:
-            if col.get('collectionMeta', {}).get('name') == COLLECTION_NAME:
-                collection_id = col['record']
-                break
-
-        if not collection_id:
-            data = self._check(
-                requests.post(f'{BASE_URL}/c',
-                              json={},
-                              headers={
-                                  **self._auth,
-                                  'X-Collection-Name': COLLECTION_NAME
-                              },
-                              timeout=TIMEOUT))
-            collection_id = data['record']
-
-        # --- Find or create the DATA bin ---
-        bins = self._check(
-            requests.get(f'{BASE_URL}/c/{collection_id}/bins',
-                         headers=self._auth,
-                         timeout=TIMEOUT))
-
-        bin_id = None
-        for b in bins:
-            if b.get('snippetMeta', {}).get('name') == 'DATA':
-                bin_id = b['record']
-                break
+        collection_id = self._find_collection()
+        bin_id = self._find_bin(collection_id, DATA_BIN_NAME)
 
         if not bin_id:
             if not include_data:
                 raise NoDataToInclude
             if not self.no_logs:
                 print('Creating a new bin...')
-            data = self._check(
-                requests.post(f'{BASE_URL}/b',
-                              json=include_data,
-                              headers={
-                                  **self._auth,
-                                  'Content-Type': 'application/json',
-                                  'X-Bin-Name': 'DATA',
-                                  'X-Collection-Id': collection_id,
-                              },
-                              timeout=TIMEOUT))
-            bin_id = data['metadata']['id']
+            bin_id = self._create_bin(collection_id, DATA_BIN_NAME,
+                                      include_data)
 
         return bin_id
 
+    def handle_index_bin(self) -> str:
+        """Return the INDEX bin ID, creating (and migrating to) it if needed.
+
+        The index maps every channel name to the ID of the bin holding that
+        channel's records (`shards`), and to the ID of the bin holding the
+        compact records of its finished videos (`archived`). If the
+        collection still uses the legacy single DATA bin, its records are
+        split into per-channel shards the first time the index is created.
+        The legacy bin itself is left untouched.
+
+        Returns:
+            The index bin ID string.
+        """
+        self._collection_id = self._find_collection()
+        bins = {}
+        for b in self._list_bins(self._collection_id):
+            bins.setdefault(b.get('snippetMeta', {}).get('name') or '',
+                            b['record'])
+        if INDEX_BIN_NAME in bins:
+            return bins[INDEX_BIN_NAME]
+        if any(x.startswith((SHARD_PREFIX, ARCHIVED_PREFIX)) for x in bins):
+            # Migrating again would orphan the bins of the lost index.
+            raise JSONBinError(
+                f'The collection has channel bins but no {INDEX_BIN_NAME} '
+                'bin! Refusing to migrate the DATA bin again.')
+
+        shards = {}
+        legacy_bin_id = bins.get(DATA_BIN_NAME)
+        if legacy_bin_id:
+            if not self.no_logs:
+                print('Migrating the DATA bin to per-channel shards...')
+            grouped = collections.defaultdict(list)
+            for record in self.read_bin(legacy_bin_id)['record']:
+                grouped[record['channel_name']].append(record)
+            for channel_name, records in grouped.items():
+                shards[channel_name] = self._create_bin(
+                    self._collection_id, bin_name(SHARD_PREFIX, channel_name),
+                    records)
+
+        if not self.no_logs:
+            print('Creating a new index bin...')
+        return self._create_bin(self._collection_id, INDEX_BIN_NAME,
+                                {'shards': shards})
+
+    def load_index(self) -> None:
+        """Read the index bin, creating it if needed."""
+        self.index_bin_id = self.handle_index_bin()
+        index = self.read_bin(self.index_bin_id)['record']
+        self._index = index['shards']
+        self._archived_index = index.get('archived', {})
+
+    def _save_index(self) -> None:
+        # The index is copied under the index lock, but written outside of
+        # it. Writes are serialized, so an older copy never overwrites a
+        # newer one.
+        with self._index_write_lock:
+            with self._lock:
+                index = {
+                    'shards': dict(self._index),
+                    'archived': dict(self._archived_index)
+                }
+            self.update_bin(self.index_bin_id, index)
+
+    def load_shards(self) -> list:
+        """Read the index and all of its shards concurrently.
+
+        The records are cached per channel, so the dicts returned here can be
+        modified in place and persisted with `update_record`. Finished videos
+        that were moved to the cold store are not included.
+
+        Returns:
+            A flat list of every record in every shard.
+        """
+        self.load_index()
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=SHARD_READ_WORKERS) as executor:
+            records = executor.map(lambda x: self.read_bin(x)['record'],
+                                   self._index.values())
+            self._shards = dict(zip(self._index, records))
+
+        records = {
+            x['_id']: x for shard in self._shards.values() for x in shard
+        }
+        with self._lock:
+            self._records = records
+        return list(records.values())
+
+    def load_archived_ids(self) -> set:
+        """Read the cold store of every channel concurrently.
+
+        Returns:
+            The IDs of all the finished videos.
+        """
+        if self.index_bin_id is None:
+            self.load_index()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=SHARD_READ_WORKERS) as executor:
+            records = executor.map(lambda x: self.read_bin(x)['record'],
+                                   self._archived_index.values())
+            archived = dict(zip(self._archived_index, records))
+        with self._lock:
+            self._archived = archived
+        self._archived_loaded = True
+        return {_id for x in self._archived.values() for _id in x}
+
+    def known_ids(self) -> set:
+        """Return the IDs of all the videos, in the shards and in the cold
+        stores. The cold stores are only read the first time."""
+        if not self._archived_loaded:
+            self.load_archived_ids()
+        with self._lock:
+            known = set(self._records)
+            for archived in self._archived.values():
+                known.update(archived)
+        return known
+
+    def records(self) -> list:
+        """Return the cached records of every shard (see `load_shards`)."""
+        with self._lock:
+            return list(self._records.values())
+
+    def archived_records(self) -> Iterator[dict]:
+        """Yield the cold records of every channel (see
+        `load_archived_ids`)."""
+        with self._lock:
+            archived = [(channel_name, list(x.items()))
+                        for channel_name, x in self._archived.items()]
+        for channel_name, items in archived:
+            for _id, fields in items:
+                yield {'_id': _id, 'channel_name': channel_name, **fields}
+
+    def get_record(self, _id: str) -> Optional[dict]:
+        """Return the cached record with the given `_id`, if any."""
+        with self._lock:
+            return self._records.get(_id)
+
+    def _shard_lock(self, channel_name: str) -> TracedLock:
+        with self._lock:
+            return self._shard_locks[channel_name]
+
+    def save_shard(self, channel_name: str) -> None:
+        """Write the cached records of one channel back to its shard.
+
+        Creates the shard (and registers it in the index) if the channel does
+        not have one yet.
+
+        Args:
+            channel_name: The channel whose shard to write.
+        """
+        with self._shard_lock(channel_name):
+            records = self._shards.setdefault(channel_name, [])
+            bin_id = self._index.get(channel_name)
+            if bin_id:
+                self.update_bin(bin_id, records)
+                return
+            bin_id = self._create_bin(self._collection_id,
+                                      bin_name(SHARD_PREFIX, channel_name),
+                                      records)
+            with self._lock:
+                self._index[channel_name] = bin_id
+            self._save_index()
+
+    def archive_records(self, channel_name: str, records: list) -> None:
+        """Move finished records of a channel to its cold store.
+
+        The cold bin is written before the shard, so an interrupted move
+        leaves a record in both, which the next `sweep` repairs.
+
+        Args:
+            channel_name: The channel of the records.
+            records: The finished records to move.
+        """
+        with self._shard_lock(channel_name):
+            archived = self._archived.get(channel_name)
+            bin_id = self._archived_index.get(channel_name)
+            if archived is None:
+                archived = self.read_bin(bin_id)['record'] if bin_id else {}
+            # The caches are read by `known_ids` under the index lock.
+            with self._lock:
+                self._archived[channel_name] = archived
+                for record in records:
+                    archived[record['_id']] = {
+                        k: v
+                        for k, v in cold_record(record).items()
+                        if k != 'channel_name'
+                    }
+            if bin_id:
+                self.update_bin(bin_id, archived)
+            else:
+                bin_id = self._create_bin(
+                    self._collection_id,
+                    bin_name(ARCHIVED_PREFIX, channel_name), archived)
+                with self._lock:
+                    self._archived_index[channel_name] = bin_id
+                self._save_index()
+
+            ids = {x['_id'] for x in records}
+            self._shards[channel_name] = [
+                x for x in self._shards.get(channel_name, [])
+                if x['_id'] not in ids
+            ]
+            with self._lock:
+                for _id in ids:
+                    self._records.pop(_id, None)
+            if self._shards[channel_name]:
+                self.save_shard(channel_name)
+                return
+            # JSONBin does not accept blank bins: drop the empty shard. It is
+            # created again when the channel gets new records.
+            with self._lock:
+                shard_bin_id = self._index.pop(channel_name, None)
+            if shard_bin_id:
+                self._save_index()
+                self.delete_bin(shard_bin_id)
+
+    def sweep(self) -> int:
+        """Move every finished record still in a shard to the cold store.
+
+        Returns:
+            The number of records moved.
+        """
+        moved = 0
+        for channel_name, records in list(self._shards.items()):
+            finished = [x for x in records if is_finished(x)]
+            if finished:
+                self.archive_records(channel_name, finished)
+                moved += len(finished)
+        return moved
+
+    def update_record(self, record: dict, **fields) -> None:
+        """Update the fields of a cached record and write only its shard.
+
+        If the update finishes the video, the record is moved to the cold
+        store instead.
+
+        Args:
+            record: The record to update. If it is not one of the cached
+                records (e.g. it was loaded by another instance), the cached
+                record with the same `_id` is updated as well.
+            **fields: The fields to set.
+        """
+        channel_name = record['channel_name']
+        with self._shard_lock(channel_name):
+            record.update(fields)
+            for cached in self._shards.get(channel_name, []):
+                if cached is not record and cached['_id'] == record['_id']:
+                    cached.update(fields)
+            if is_finished(record):
+                self.archive_records(channel_name, [record])
+            else:
+                self.save_shard(channel_name)
+
+    def add_records(self, records: list) -> None:
+        """Append new records to their channel shards.
+
+        Args:
+            records: The records to add. Each must have a `channel_name`.
+        """
+        grouped = collections.defaultdict(list)
+        for record in records:
+            grouped[record['channel_name']].append(record)
+        for channel_name, new_records in grouped.items():
+            with self._shard_lock(channel_name):
+                self._shards.setdefault(channel_name, []).extend(new_records)
+                with self._lock:
+                    self._records.update({x['_id']: x for x in new_records})
+                self.save_shard(channel_name)
+
     def read_bin(self, bin_id: str) -> dict:
         """Read a bin and return the full API response.
 
@@ -123,6 +447,22 @@ class JSONBin:
                          headers=self._auth,
                          timeout=TIMEOUT))
 
+    def delete_bin(self, bin_id: str) -> dict:
+        """Delete a bin.
+
+        Args:
+            bin_id: The bin ID.
+
+        Returns:
+            The API response dict.
+        """
+        # The response of a successful deletion has a `message` too.
+        resp = requests.delete(f'{BASE_URL}/b/{bin_id}',
+                               headers=self._auth,
+                               timeout=TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()
+
     def update_bin(self, bin_id: str, data) -> dict:
         """Replace the bin contents.
 
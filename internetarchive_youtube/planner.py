@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Capacity planning: a forecast of how the pending backlog gets archived.
+
+The size of every pending video is taken from its scan-time metadata. Videos
+scanned without a size are estimated from their duration and the bitrate of
+their channel (or of the whole backlog); the durations that are missing too
+are read from a single flat listing of each channel. The scheduler is then
+simulated: up to `threads` videos are processed at once, every active
+download (or upload) gets an equal share of the bandwidth, a video holds its
+size on disk from the start of its download to the end of its upload, and a
+run stops at the timeout, losing the videos in progress.
+"""
+
+import collections
+import concurrent.futures
+import math
+import statistics
+from typing import Optional
+
+import yt_dlp
+from loguru import logger
+
+from internetarchive_youtube.archive_youtube import ArchiveYouTube
+
+# Assumptions of the simulation.
+DEFAULT_BITRATE = 250 * 1024  # bytes per second of video (~2 Mbit/s)
+DEFAULT_SIZE = 100 * 1024**2
+CONNECTION_RATE = 8 * 1024**2  # fastest single download or upload
+VIDEO_OVERHEAD = 15  # seconds per video (extraction, item checks, state)
+# Known sizes a channel needs for its own estimates (otherwise those of the
+# whole backlog are used).
+MIN_SAMPLES = 5
+LOOKUP_WORKERS = 4
+MAX_RUNS = 10000
+
+OVERHEAD = 'overhead'
+DOWNLOAD = 'download'
+UPLOAD = 'upload'
+
+
+class PlannedVideo:
+    """A pending video, with its known or estimated size."""
+    __slots__ = ('_id', 'channel_name', 'size', 'estimated')
+
+    def __init__(self, _id: str, channel_name: str, size: int,
+                 estimated: bool) -> None:
+        self._id = _id
+        self.channel_name = channel_name
+        self.size = size
+        self.estimated = estimated
+
+
+def lookup_durations(ayt: ArchiveYouTube, channel_urls: list) -> dict:
+    """Read the durations of the videos of channels, with one flat listing
+    per channel.
+
+    Args:
+        ayt: The job whose yt-dlp options to use.
+        channel_urls: The URLs of the channels.
+
+    Returns:
+        A dict of video ID to duration (in seconds).
+    """
+
+    def _lookup(channel_url: str) -> dict:
+        durations = {}
+        try:
+            with ayt.ydl_pool.get(quiet=True,
+                                  extract_flat='in_playlist') as ydl:
+                info = ydl.extract_info(channel_url, download=False)
+        except yt_dlp.utils.DownloadError as e:
+            logger.warning(f'Could not list {channel_url}: {e}')
+            return durations
+        entries = list(info.get('entries') or [])
+        while entries:
+            entry = entries.pop()
+            if not entry:
+                continue
+            if entry.get('entries'):
+                entries.extend(entry['entries'])
+            elif entry.get('id') and entry.get('duration'):
+                durations[entry['id']] = entry['duration']
+        return durations
+
+    durations = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=LOOKUP_WORKERS) as executor:
+        for result in executor.map(_lookup, channel_urls):
+            durations.update(result)
+    return durations
+
+
+def estimate_sizes(refs: list,
+                   durations: Optional[dict] = None) -> list:
+    """Return the pending videos with their known or estimated sizes.
+
+    Args:
+        refs: `VideoRef` of the pending videos.
+        durations: Durations of videos that have none in their reference
+            (see `lookup_durations`).
+
+    Returns:
+        A list of `PlannedVideo`, in the order of `refs`.
+    """
+    durations = durations or {}
+    known_bytes = collections.Counter()
+    known_seconds = collections.Counter()
+    channel_sizes = collections.defaultdict(list)
+    for ref in refs:
+        if ref.size:
+            channel_sizes[ref.channel_name].append(ref.size)
+            if ref.duration:
+                known_bytes[ref.channel_name] += ref.size
+                known_seconds[ref.channel_name] += ref.duration
+    all_sizes = [x for sizes in channel_sizes.values() for x in sizes]
+    bitrate = DEFAULT_BITRATE
+    if sum(known_seconds.values()):
+        bitrate = sum(known_bytes.values()) / sum(known_seconds.values())
+    median_size = statistics.median(all_sizes) if all_sizes else DEFAULT_SIZE
+
+    videos = []
+    for ref in refs:
+        if ref.size:
+            videos.append(
+                PlannedVideo(ref._id, ref.channel_name, ref.size, False))
+            continue
+        duration = ref.duration or durations.get(ref._id)
+        if duration:
+            channel_bitrate = bitrate
+            if len(channel_sizes[ref.channel_name]) >= MIN_SAMPLES and \
+                    known_seconds[ref.channel_name]:
+                channel_bitrate = known_bytes[ref.channel_name] / \
+                    known_seconds[ref.channel_name]
+            size = duration * channel_bitrate
+        elif len(channel_sizes[ref.channel_name]) >= MIN_SAMPLES:
+            size = statistics.median(channel_sizes[ref.channel_name])
+        else:
+            size = median_size
+        videos.append(
+            PlannedVideo(ref._id, ref.channel_name, int(size), True))
+    return videos
+
+
+class _Job:
+    __slots__ = ('video', 'phase', 'remaining')
+
+    def __init__(self, video: PlannedVideo) -> None:
+        self.video = video
+        self.phase = OVERHEAD
+        self.remaining = VIDEO_OVERHEAD
+
+
+def _rates(jobs: list, download_rate: Optional[float],
+           upload_rate: Optional[float],
+           total_rate: Optional[float]) -> list:
+    """Return the rate of each job (seconds or bytes per second)."""
+    n = collections.Counter(x.phase for x in jobs)
+    caps = {
+        DOWNLOAD: download_rate or math.inf,
+        UPLOAD: upload_rate or math.inf
+    }
+    if total_rate:
+        # Each direction is guaranteed half of the total, and may use all of
+        # it when the other one is idle (see `BandwidthManager`).
+        share = total_rate / 2 if n[DOWNLOAD] and n[UPLOAD] else total_rate
+        caps = {k: min(v, share) for k, v in caps.items()}
+    return [
+        1 if x.phase == OVERHEAD else min(CONNECTION_RATE,
+                                          caps[x.phase] / n[x.phase])
+        for x in jobs
+    ]
+
+
+def simulate(videos: list,
+             threads: int,
+             download_rate: Optional[float] = None,
+             upload_rate: Optional[float] = None,
+             total_rate: Optional[float] = None,
+             disk_budget: Optional[float] = None,
+             timeout: Optional[float] = None,
+             stream: bool = False) -> dict:
+    """Simulate the runs that archive a backlog.
+
+    Args:
+        videos: The `PlannedVideo` to archive, in processing order.
+        threads: Number of videos processed at once.
+        download_rate: Ceiling of all downloads combined, in bytes per
+            second.
+        upload_rate: Ceiling of all uploads combined, in bytes per second.
+        total_rate: Ceiling of downloads and uploads combined, in bytes per
+            second.
+        disk_budget: Disk space available for downloads, in bytes.
+        timeout: Length of a run, in seconds (None: a single run).
+        stream: Whether downloads are streamed (they then use no disk).
+
+    Returns:
+        A dict with the `runs` (videos and peak disk use of each run), the
+        `done` videos as (video, run index, seconds into the run) tuples, and
+        the `unfinished` videos (larger than the disk budget, or too long to
+        archive in one run).
+    """
+    queue = collections.deque(videos)
+    runs = []
+    done = []
+    unfinished = []
+    while queue and len(runs) < MAX_RUNS:
+        t = disk = peak = completed = 0
+        active = []
+        while True:
+            while len(active) < threads and queue:
+                size = 0 if stream else queue[0].size
+                if disk_budget and disk + size > disk_budget:
+                    if active:
+                        break
+                    unfinished.append(queue.popleft())
+                    continue
+                active.append(_Job(queue.popleft()))
+                disk += size
+                peak = max(peak, disk)
+            if not active:
+                break
+            rates = _rates(active, download_rate, upload_rate, total_rate)
+            dt = min(x.remaining / r for x, r in zip(active, rates))
+            if timeout and t + dt > timeout:
+                # The videos in progress are lost, and retried next run.
+                queue.extendleft(reversed([x.video for x in active]))
+                t = timeout
+                break
+            t += dt
+            still_active = []
+            for job, rate in zip(active, rates):
+                job.remaining -= rate * dt
+                if job.remaining > 1e-6:
+                    still_active.append(job)
+                elif job.phase == OVERHEAD:
+                    job.phase, job.remaining = DOWNLOAD, job.video.size
+                    still_active.append(job)
+                elif job.phase == DOWNLOAD:
+                    job.phase, job.remaining = UPLOAD, job.video.size
+                    still_active.append(job)
+                else:
+                    disk -= 0 if stream else job.video.size
+                    done.append((job.video, len(runs), t))
+                    completed += 1
+            active = still_active
+        runs.append({'videos': completed, 'peak_disk': peak, 'seconds': t})
+        if not completed and queue:
+            # Nothing fits in a run: the next runs would not do better.
+            unfinished.extend(queue)
+            queue.clear()
+    unfinished.extend(queue)
+    return {'runs': runs, 'done': done, 'unfinished': unfinished}
+
+
+def channel_report(videos: list, result: dict,
+                   timeout: Optional[float]) -> list:
+    """Summarize a simulation per channel.
+
+    Args:
+        videos: The simulated `PlannedVideo`.
+        result: The result of `simulate`.
+        timeout: Length of a run, in seconds.
+
+    Returns:
+        A list of dicts (channel, videos, size, runs, seconds to clear the
+        channel's backlog with back-to-back runs, unfinished videos), sorted
+        by the time to clear.
+    """
+    channels = {}
+    for video in videos:
+        channel = channels.setdefault(video.channel_name, {
+            'channel': video.channel_name,
+            'videos': 0,
+            'size': 0,
+            'runs': 0,
+            'seconds': 0,
+            'unfinished': 0
+        })
+        channel['videos'] += 1
+        channel['size'] += video.size
+    for video, run, t in result['done']:
+        channel = channels[video.channel_name]
+        channel['runs'] = max(channel['runs'], run + 1)
+        elapsed = sum(x['seconds'] for x in result['runs'][:run]) + t
+        channel['seconds'] = max(channel['seconds'], elapsed)
+    for video in result['unfinished']:
+        channels[video.channel_name]['unfinished'] += 1
+    return sorted(channels.values(), key=lambda x: x['seconds'])
+
+
+def plan(ayt: ArchiveYouTube,
+         threads: int,
+         download_rate: Optional[float] = None,
+         upload_rate: Optional[float] = None,
+         total_rate: Optional[float] = None,
+         disk_budget: Optional[float] = None,
+         timeout: Optional[float] = None,
+         lookups: bool = True) -> Optional[dict]:
+    """Forecast how the pending backlog of a job gets archived.
+
+    Args:
+        ayt: The job to plan.
+        threads: Number of videos processed at once.
+        download_rate: Ceiling of all downloads combined, in bytes per
+            second.
+        upload_rate: Ceiling of all uploads combined, in bytes per second.
+        total_rate: Ceiling of downloads and uploads combined, in bytes per
+            second.
+        disk_budget: Disk space available for downloads, in bytes.
+        timeout: Length of a run, in seconds.
+        lookups: List the channels of videos that have neither a size nor a
+            duration, to read their durations.
+
+    Returns:
+        The result of `simulate`, with the planned `videos` and the
+        per-channel report (`channels`), or None if nothing is pending.
+    """
+    mongodb, jsonbin, col, jb, _, refs = ayt.load_data()
+    if not refs:
+        return None
+
+    durations = {}
+    missing = {}
+    for ref in refs:
+        if not ref.size and not ref.duration:
+            missing.setdefault(ref.channel_name, ref)
+    if lookups and missing:
+        channel_urls = []
+        for ref in missing.values():
+            video = ayt.fetch_video(ref, mongodb, jsonbin, col, jb)
+            if video and video.get('channel_url'):
+                channel_urls.append(video['channel_url'])
+        logger.debug(f'Listing {len(channel_urls)} channels for the '
+                     'durations of their videos...')
+        durations = lookup_durations(ayt, channel_urls)
+
+    videos = estimate_sizes(refs, durations)
+    result = simulate(videos,
+                      threads,
+                      download_rate=download_rate,
+                      upload_rate=upload_rate,
+                      total_rate=total_rate,
+                      disk_budget=disk_budget,
+                      timeout=timeout,
+                      stream=ayt.stream)
+    result['videos'] = videos
+    result['channels'] = channel_report(videos, result, timeout)
+    return result
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Opt-in profiling and stage tracing.
+
+When enabled (`--profile`), every traced stage is recorded in a Chrome trace
+timeline (`trace.json`, viewable in chrome://tracing or Perfetto), and the
+top-level stages (`load_data`, `process_video`, `create_collection`) are
+profiled per stage, either with cProfile (`<stage>.prof`) or with a sampling
+profiler that sees all threads (`<stage>.folded`, in the collapsed stack
+format used by flamegraph.pl and speedscope).
+
+When profiling is disabled, all of the helpers here are no-ops.
+"""
+
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+SAMPLE_INTERVAL = 0.005
+
+_profiler = None
+
+
+class Profiler:
+    """Collects the stage timeline and the per-stage profiles."""
+
+    def __init__(self,
+                 output_dir: str,
+                 mode: str = SAMPLE,
+                 interval: float = SAMPLE_INTERVAL) -> None:
+        """Initialize the profiler.
+
+        Args:
+            output_dir: Directory to write the profiles and the trace to.
+            mode: `cprofile` or `sample`.
+            interval: Seconds between two samples in `sample` mode.
+        """
+        self.output_dir = Path(output_dir)
+        self.mode = mode
+        self.interval = interval
+        self._t0 = time.perf_counter()
+        self._events = []
+        self._stats = {}
+        self._samples = collections.defaultdict(collections.Counter)
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _us(self, t: float) -> float:
+        return (t - self._t0) * 1e6
+
+    def start(self) -> None:
+        if self.mode == SAMPLE:
+            self._sampler = threading.Thread(target=self._sample_loop,
+                                             name='profiler-sampler',
+                                             daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()  # noqa
+            with self._lock:
+                stages = dict(self._stages)
+            for thread_id, frame in frames.items():
+                if thread_id == own_id or thread_id not in stages:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{Path(code.co_filename).name}:'
+                                 f'{code.co_name}:{frame.f_lineno}')
+                    frame = frame.f_back
+                self._samples[stages[thread_id]][';'.join(
+                    reversed(stack))] += 1
+
+    def record(self,
+               name: str,
+               start: float,
+               end: float,
+               cat: str = 'stage',
+               **args) -> None:
+        """Add a finished span to the timeline.
+
+        Args:
+            name: Name of the span.
+            start: `time.perf_counter()` at the start of the span.
+            end: `time.perf_counter()` at the end of the span.
+            cat: Category of the span.
+            **args: Extra values to show with the span.
+        """
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': self._us(start),
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': {k: str(v)
+                     for k, v in args.items()}
+        }
+        with self._lock:
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, profile: bool = False, **args):
+        """Trace (and optionally profile) the enclosed block."""
+        thread_id = threading.get_ident()
+        prof = None
+        if profile:
+            if self.mode == CPROFILE:
+                prof = cProfile.Profile()
+                try:
+                    prof.enable()
+                except ValueError:
+                    # Python >= 3.12 allows one active cProfile at a time.
+                    prof = None
+            else:
+                with self._lock:
+                    previous = self._stages.get(thread_id)
+                    self._stages[thread_id] = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if prof is not None:
+                prof.disable()
+                with self._lock:
+                    if name in self._stats:
+                        self._stats[name].add(prof)
+                    else:
+                        self._stats[name] = pstats.Stats(prof)
+            elif profile and self.mode == SAMPLE:
+                with self._lock:
+                    if previous:
+                        self._stages[thread_id] = previous
+                    else:
+                        self._stages.pop(thread_id, None)
+            self.record(name, start, end, **args)
+
+    def stop(self) -> None:
+        """Stop sampling and write everything to the output directory."""
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for name, stats in self._stats.items():
+                stats.dump_stats(self.output_dir / f'{name}.prof')
+            for name, samples in self._samples.items():
+                with open(self.output_dir / f'{name}.folded', 'w') as f:
+                    for stack, count in samples.most_common():
+                        f.write(f'{stack} {count}\n')
+            with open(self.output_dir / 'trace.json', 'w') as j:
+                json.dump({'traceEvents': self._events}, j)
+        logger.info(f'Profiles and trace were written to: {self.output_dir}')
+
+
+def enable(output_dir: str, mode: str = SAMPLE) -> Profiler:
+    """Enable profiling for the rest of the process.
+
+    Args:
+        output_dir: Directory to write the profiles and the trace to.
+        mode: `cprofile` or `sample`.
+
+    Returns:
+        The active profiler.
+    """
+    global _profiler
+    _profiler = Profiler(output_dir, mode=mode)
+    _profiler.start()
+    return _profiler
+
+
+def disable() -> None:
+    """Disable profiling and write the results, if it was enabled."""
+    global _profiler
+    if _profiler:
+        _profiler.stop()
+        _profiler = None
+
+
+def span(name: str, profile: bool = False, **args):
+    """Return a context manager that traces the enclosed block.
+
+    Args:
+        name: Name of the stage.
+        profile: Also profile the block. Only use for top-level stages, since
+            cProfile cannot nest.
+        **args: Extra values to show with the span in the trace.
+    """
+    if not _profiler:
+        return contextlib.nullcontext()
+    return _profiler.span(name, profile=profile, **args)
+
+
+def record(name: str, start: float, end: float, cat: str = 'stage',
+           **args) -> None:
+    """Add a finished span to the timeline, if profiling is enabled."""
+    if _profiler:
+        _profiler.record(name, start, end, cat=cat, **args)
+
+
+def profiled(name: str):
+    """Decorator that traces and profiles every call of a function as the
+    stage `name`."""
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, profile=True):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracedLock:
+    """A lock wrapper that records the time spent waiting to acquire it."""
+
+    def __init__(self, lock, name: str) -> None:
+        self._lock = lock
+        self.name = name
+
+    def __enter__(self):
+        if not _profiler:
+            return self._lock.__enter__()
+        start = time.perf_counter()
+        if not self._lock.acquire(blocking=False):
+            self._lock.acquire()
+            record(f'wait {self.name}',
+                   start,
+                   time.perf_counter(),
+                   cat='lock')
+        return self
+
+    def __exit__(self, *exc) -> Optional[bool]:
+        return self._lock.__exit__(*exc)
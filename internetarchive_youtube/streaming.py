@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Zero-disk streaming of downloads into archive.org multipart uploads.
+
+yt-dlp writes the download to a named pipe instead of a file. The bytes are
+read from the pipe as they arrive, cut into parts and uploaded as an IA-S3
+multipart upload, so the video never touches the disk and the upload runs
+while the video is still downloading. At most `QUEUE_PARTS` parts wait for
+the uploader, which bounds the memory of each stream to about
+`(QUEUE_PARTS + 2) * part_size`.
+
+Only formats that yt-dlp writes sequentially (a single file, downloaded
+over HTTP(S) by yt-dlp itself) can be streamed.
+"""
+
+import base64
+import hashlib
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Optional, Union
+from urllib.parse import quote
+
+import internetarchive
+import requests
+from internetarchive.auth import S3Auth
+from internetarchive.iarequest import S3Request
+from loguru import logger
+
+from internetarchive_youtube.bandwidth import BandwidthManager
+
+S3_URL = 'https://s3.us.archive.org'
+STREAMABLE_PROTOCOLS = ['http', 'https']
+# S3 rejects parts smaller than this (except for the last one).
+MIN_PART_SIZE = 5 * 1024**2
+PART_SIZE = 16 * 1024**2
+QUEUE_PARTS = 2
+READ_SIZE = 1024**2
+REQUEST_RETRIES = 3
+RETRY_DELAY = 60
+
+
+class NotStreamable(Exception):
+    """Raised when the selected format of a video cannot be streamed."""
+
+
+def can_stream() -> bool:
+    """Return True if the platform supports named pipes."""
+    return hasattr(os, 'mkfifo')
+
+
+def check_streamable(info: dict) -> None:
+    """Raise `NotStreamable` unless yt-dlp writes a format sequentially.
+
+    Args:
+        info: The info dict returned by `YoutubeDL.extract_info`.
+    """
+    if info.get('requested_formats'):
+        raise NotStreamable('The formats need to be merged.')
+    if info.get('protocol') not in STREAMABLE_PROTOCOLS:
+        raise NotStreamable(f'Unsupported protocol: {info.get("protocol")}.')
+
+
+class MultipartUpload:
+    """An IA-S3 multipart upload of one file to an item."""
+
+    def __init__(self,
+                 identifier: str,
+                 key: str,
+                 metadata: dict,
+                 size_hint: Optional[int] = None,
+                 session: Optional[internetarchive.ArchiveSession] = None):
+        """Initialize the upload.
+
+        Args:
+            identifier: Identifier of the item (created if it does not exist).
+            key: Name of the file in the item.
+            metadata: Metadata of the item.
+            size_hint: Expected size of the file, in bytes.
+            session: The archive.org session (default: from the config).
+        """
+        self.identifier = identifier
+        self.key = key
+        self.metadata = metadata
+        self.size_hint = size_hint
+        self.session = session or internetarchive.get_session()
+        self.url = f'{S3_URL}/{identifier}/{quote(key)}'
+        self.upload_id = None
+        self._etags = []
+
+    def _send(self, request: requests.Request) -> requests.Response:
+        """Send a request, retrying when archive.org asks to slow down."""
+        request.auth = request.auth or S3Auth(self.session.access_key,
+                                              self.session.secret_key)
+        prepared = self.session.prepare_request(request)
+        for attempt in range(REQUEST_RETRIES + 1):
+            try:
+                r = self.session.send(prepared)
+                if r.status_code != 503 or attempt == REQUEST_RETRIES:
+                    r.raise_for_status()
+                    return r
+            except requests.exceptions.ConnectionError:
+                if attempt == REQUEST_RETRIES:
+                    raise
+            logger.debug(f'Retrying {request.method} {self.url} in '
+                         f'{RETRY_DELAY} seconds...')
+            time.sleep(RETRY_DELAY)
+
+    def start(self) -> None:
+        """Create the multipart upload (and the item, if needed)."""
+        headers = {}
+        if self.size_hint:
+            headers['x-archive-size-hint'] = str(self.size_hint)
+        r = self._send(
+            S3Request(method='POST',
+                      url=f'{self.url}?uploads',
+                      headers=headers,
+                      metadata=self.metadata,
+                      access_key=self.session.access_key,
+                      secret_key=self.session.secret_key))
+        self.upload_id = r.text.split('<UploadId>')[1].split('</UploadId>')[0]
+
+    def upload_part(self, data: bytes) -> None:
+        """Upload the next part."""
+        number = len(self._etags) + 1
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        r = self._send(
+            requests.Request(method='PUT',
+                             url=self.url,
+                             params={
+                                 'partNumber': number,
+                                 'uploadId': self.upload_id
+                             },
+                             headers={'Content-MD5': md5},
+                             data=data))
+        self._etags.append(r.headers['ETag'])
+
+    def complete(self) -> requests.Response:
+        """Assemble the uploaded parts into the file."""
+        parts = ''.join(f'<Part><PartNumber>{i}</PartNumber>'
+                        f'<ETag>{etag}</ETag></Part>'
+                        for i, etag in enumerate(self._etags, start=1))
+        r = self._send(
+            requests.Request(
+                method='POST',
+                url=self.url,
+                params={'uploadId': self.upload_id},
+                data=f'<CompleteMultipartUpload>{parts}'
+                '</CompleteMultipartUpload>'))
+        # Errors can also come with a 200 status code.
+        if '<Error>' in r.text:
+            raise requests.exceptions.HTTPError(r.text, response=r)
+        return r
+
+    def abort(self) -> None:
+        """Discard the uploaded parts."""
+        if not self.upload_id:
+            return
+        try:
+            self._send(
+                requests.Request(method='DELETE',
+                                 url=self.url,
+                                 params={'uploadId': self.upload_id}))
+        except requests.exceptions.RequestException as e:
+            logger.warning(f'Could not abort the upload of {self.url}: {e}')
+
+
+class PipeUpload:
+    """A named pipe whose content is uploaded as a `MultipartUpload`.
+
+    Use it as a context manager, have yt-dlp download to `path`, then call
+    `finish`. If the block exits without `finish`, the upload is aborted.
+    """
+
+    def __init__(self,
+                 upload: MultipartUpload,
+                 part_size: int = PART_SIZE,
+                 bandwidth: Optional[BandwidthManager] = None,
+                 on_upload: Optional[Callable[[int], None]] = None) -> None:
+        """Initialize the pipe.
+
+        Args:
+            upload: The multipart upload to write to. It is started when the
+                first part is ready.
+            part_size: Size of each uploaded part, in bytes.
+            bandwidth: Bandwidth manager to pace the upload with.
+            on_upload: Called with the size of every uploaded part.
+        """
+        self.upload = upload
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.bandwidth = bandwidth
+        self.on_upload = on_upload
+        self.path = None
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._parts = queue.Queue(maxsize=QUEUE_PARTS)
+        self._keepalive = None
+        self._error = None
+        self._aborted = threading.Event()
+        self._finished = False
+        self._tmp_dir = None
+        self._threads = []
+
+    @property
+    def md5(self) -> str:
+        return self._md5.hexdigest()
+
+    def __enter__(self) -> 'PipeUpload':
+        self._tmp_dir = tempfile.mkdtemp(prefix='ia-yt-')
+        self.path = os.path.join(self._tmp_dir, self.upload.key)
+        os.mkfifo(self.path)
+        # Open the read end without blocking, then hold a write end, so that
+        # the pipe only reaches its end once the download is over (and not
+        # when yt-dlp closes and reopens the file between writes).
+        fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        os.set_blocking(fd, True)
+        self._keepalive = os.open(self.path, os.O_WRONLY)
+        self._threads = [
+            threading.Thread(target=self._read,
+                             args=(fd, ),
+                             name='stream-reader',
+                             daemon=True),
+            threading.Thread(target=self._upload_parts,
+                             name='stream-uploader',
+                             daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if not self._finished:
+            self.abort()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def _close_keepalive(self) -> None:
+        if self._keepalive is not None:
+            os.close(self._keepalive)
+            self._keepalive = None
+
+    def _read(self, fd: int) -> None:
+        buffer = bytearray()
+        try:
+            with os.fdopen(fd, 'rb', buffering=0) as pipe:
+                while True:
+                    chunk = pipe.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    self._md5.update(chunk)
+                    self.size += len(chunk)
+                    buffer += chunk
+                    if len(buffer) >= self.part_size:
+                        self._parts.put(bytes(buffer))
+                        buffer.clear()
+            if buffer or not self.size:
+                self._parts.put(bytes(buffer))
+        except Exception as e:  # noqa
+            self._error = self._error or e
+        finally:
+            self._parts.put(None)
+
+    def _upload_parts(self) -> None:
+        while True:
+            part = self._parts.get()
+            if part is None:
+                break
+            # After an error, keep draining the queue so the download is
+            # never blocked on a full pipe.
+            if self._error or self._aborted.is_set():
+                continue
+            try:
+                if self.upload.upload_id is None:
+                    self.upload.start()
+                if self.bandwidth:
+                    self.bandwidth.consume_upload(len(part))
+                self.upload.upload_part(part)
+                if self.on_upload:
+                    self.on_upload(len(part))
+            except Exception as e:  # noqa
+                self._error = e
+        if self._error or self._aborted.is_set():
+            self.upload.abort()
+
+    def finish(self, expected_size: Optional[int] = None) -> Union[int, str]:
+        """Wait until the whole download is uploaded, and complete the
+        upload.
+
+        Args:
+            expected_size: Size of the download (in bytes). The upload is
+                aborted if the pipe received a different number of bytes
+                (e.g. the download was restarted into the pipe).
+
+        Returns:
+            200 on success, otherwise the error message.
+        """
+        self._finished = True
+        self._close_keepalive()
+        for thread in self._threads:
+            thread.join()
+        if not self._error and expected_size is not None and \
+                self.size != expected_size:
+            self.upload.abort()
+            return (f'The pipe received {self.size} bytes instead of '
+                    f'{expected_size}')
+        if self._error:
+            return str(self._error)
+        try:
+            r = self.upload.complete()
+        except requests.exceptions.RequestException as e:
+            self.upload.abort()
+            return str(e)
+        return r.status_code
+
+    def abort(self) -> None:
+        """Stop uploading and discard the uploaded parts.
+
+        Does not wait for the threads, in case the download left the pipe
+        open; they abort the upload once the pipe is closed.
+        """
+        self._finished = True
+        self._aborted.set()
+        self._close_keepalive()
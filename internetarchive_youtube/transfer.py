@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Bulk export and import of the state, as gzip-compressed NDJSON.
+
+An export holds one JSON record per line: the records of the hot state, then
+those of the cold store. The file is written and read one record at a time,
+so it never has to fit in memory, and it can be imported into either backend
+(e.g. to migrate from JSONBin to MongoDB, or to seed a new runner).
+
+An import is written in batches and skips the `_id`s that the target already
+has (in the hot or the cold store), so an interrupted import is resumed by
+running it again.
+"""
+
+import gzip
+import json
+from typing import Iterable, Iterator, Optional, Tuple
+
+from pymongo.collection import Collection
+
+from internetarchive_youtube.cold_store import (archived_collection,
+                                                cold_record, is_finished,
+                                                known_ids_mongo)
+from internetarchive_youtube.jsonbin_manager import JSONBin
+
+BATCH_SIZE = 1000
+
+
+def iter_records(mongodb: bool, col: Optional[Collection],
+                 jb: Optional[JSONBin]) -> Iterator[dict]:
+    """Yield every record of a backend, hot records first.
+
+    With MongoDB, the records are read with cursors, `BATCH_SIZE` at a time.
+    JSONBin bins can only be read whole, so its shards are loaded first.
+
+    Args:
+        mongodb: Whether to read from MongoDB (otherwise from JSONBin).
+        col: The hot MongoDB collection.
+        jb: The JSONBin instance.
+    """
+    if mongodb:
+        yield from col.find({}, batch_size=BATCH_SIZE)
+        yield from archived_collection(col).find({}, batch_size=BATCH_SIZE)
+        return
+    yield from jb.load_shards()
+    jb.load_archived_ids()
+    yield from jb.archived_records()
+
+
+def export_records(path: str, records: Iterable[dict]) -> int:
+    """Write records to a gzip-compressed NDJSON file.
+
+    Args:
+        path: The file to write.
+        records: The records to write.
+
+    Returns:
+        The number of records written.
+    """
+    n = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':'), default=str))
+            f.write('\n')
+            n += 1
+    return n
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """Yield the records of a gzip-compressed NDJSON file, one at a time."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _batches(records: Iterable[dict]) -> Iterator[list]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_records(records: Iterable[dict], mongodb: bool,
+                   col: Optional[Collection],
+                   jb: Optional[JSONBin]) -> Tuple[int, int]:
+    """Load records into a backend, in batches of `BATCH_SIZE`.
+
+    Finished records go to the cold store (which only keeps their cold
+    fields), the others to the hot state. Records whose `_id` is already in
+    the backend are skipped.
+
+    Args:
+        records: The records to load.
+        mongodb: Whether to write to MongoDB (otherwise to JSONBin).
+        col: The hot MongoDB collection.
+        jb: The JSONBin instance.
+
+    Returns:
+        tuple: (number of records imported, number of records skipped)
+    """
+    imported = skipped = 0
+    known = None
+    if not mongodb:
+        jb.load_shards()
+        known = jb.known_ids()
+    for batch in _batches(records):
+        ids = [x['_id'] for x in batch]
+        if mongodb:
+            batch_known = known_ids_mongo(col, ids)
+        else:
+            batch_known = known.intersection(ids)
+        new = {}
+        for record in batch:
+            if record['_id'] not in batch_known:
+                new.setdefault(record['_id'], record)
+        skipped += len(batch) - len(new)
+        hot = [x for x in new.values() if not is_finished(x)]
+        cold = [x for x in new.values() if is_finished(x)]
+
+        if mongodb:
+            if hot:
+                col.insert_many(hot, ordered=False)
+            if cold:
+                archived_collection(col).insert_many(
+                    [{
+                        '_id': x['_id'],
+                        **cold_record(x)
+                    } for x in cold],
+                    ordered=False)
+        else:
+            if hot:
+                jb.add_records(hot)
+            channels = {}
+            for record in cold:
+                channels.setdefault(record['channel_name'], []).append(record)
+            for channel_name, channel_records in channels.items():
+                jb.archive_records(channel_name, channel_records)
+            known.update(new)
+        imported += len(new)
+    return imported, skipped
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Long-lived, per-thread `YoutubeDL` instances."""
+
+import contextlib
+import threading
+
+import yt_dlp
+from yt_dlp.utils import DEFAULT_OUTTMPL
+
+# Options that `YoutubeDL` only reads when it is constructed. Overriding them
+# for one call needs a separate instance.
+INIT_ONLY_PARAMS = ['format', 'cookiefile', 'cookiesfrombrowser']
+
+_MISSING = object()
+
+
+class _PooledYoutubeDL:
+    """A `YoutubeDL` instance and the progress hooks of its current user."""
+
+    def __init__(self, params: dict) -> None:
+        self.hooks = []
+        self.in_use = False
+        self.ydl = yt_dlp.YoutubeDL({
+            **params, 'progress_hooks': [self._dispatch]
+        })
+
+    def _dispatch(self, d: dict) -> None:
+        for hook in list(self.hooks):
+            hook(d)
+
+
+class YoutubeDLPool:
+    """Hands out one long-lived `YoutubeDL` instance per thread.
+
+    Each instance is configured once with the options of the run, so the
+    extractors, the cookie jar and the player/signature caches are set up
+    once per thread and reused for every video, instead of once per call.
+    """
+
+    def __init__(self, params: dict) -> None:
+        """Initialize the pool.
+
+        Args:
+            params: The `YoutubeDL` options shared by every call.
+        """
+        self.params = params
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+
+    def _instance(self) -> _PooledYoutubeDL:
+        pooled = getattr(self._local, 'pooled', None)
+        if pooled is None:
+            pooled = self._local.pooled = _PooledYoutubeDL(self.params)
+            with self._lock:
+                self._instances.append(pooled)
+        return pooled
+
+    @contextlib.contextmanager
+    def get(self, outtmpl: str = None, progress_hooks: list = None, **params):
+        """Borrow the instance of the current thread.
+
+        Args:
+            outtmpl: Output template for this call (default: yt-dlp's).
+            progress_hooks: Progress hooks for this call.
+            **params: Other options to override for this call.
+
+        Yields:
+            The `YoutubeDL` instance.
+        """
+        pooled = self._instance()
+        if pooled.in_use or any(
+                params.get(k, self.params.get(k)) != self.params.get(k)
+                for k in INIT_ONLY_PARAMS):
+            # Nested use in the same thread, or options that only apply to a
+            # new instance: use a temporary one.
+            with yt_dlp.YoutubeDL({
+                    **self.params,
+                    **params,
+                    'outtmpl': outtmpl or DEFAULT_OUTTMPL['default'],
+                    'progress_hooks': progress_hooks or []
+            }) as ydl:
+                yield ydl
+            return
+
+        ydl = pooled.ydl
+        saved = {k: ydl.params.get(k, _MISSING) for k in params}
+        saved_outtmpl = ydl.params['outtmpl']['default']
+        ydl.params.update(params)
+        ydl.params['outtmpl']['default'] = outtmpl or DEFAULT_OUTTMPL[
+            'default']
+        pooled.hooks = list(progress_hooks or [])
+        pooled.in_use = True
+        try:
+            yield ydl
+        finally:
+            pooled.in_use = False
+            pooled.hooks = []
+            ydl.params['outtmpl']['default'] = saved_outtmpl
+            for k, v in saved.items():
+                if v is _MISSING:
+                    ydl.params.pop(k, None)
+                else:
+                    ydl.params[k] = v
+
+    def close(self) -> None:
+        """Close every instance (which also saves the cookie jar)."""
+        with self._lock:
+            instances, self._instances = self._instances, []
+        for pooled in instances:
+            pooled.ydl.__exit__(None, None, None)
+        self._local = threading.local()